@@ -11,6 +11,7 @@ from shiny.types import NavSetArg, FileInfo
 from shinywidgets import render_plotly
 
 from special.estimation import species_estimator
+from special.estimation.checkpoint_schedule import GeometricSchedule
 from special.visualization.visualization import plot_expected_sampling_effort, plot_completeness_profile, \
     plot_diversity_profile, plot_diversity_series_all, plot_diversity_series, plot_diversity_sample_vs_estimate, \
     plot_rank_abundance
@@ -37,8 +38,9 @@ def refresh_log_profile_cache(species_retrival: str) -> None:
         return
     print("Cache does not exist")
 
-    step_size = int(len(shared.EVENT_LOG_REF) / 200)
-    estimator = species_estimator.SpeciesEstimator(d0=True, d1=True, d2=True, c0=True, c1=True, step_size=step_size)
+    # checkpoints are spaced logarithmically, as the profiles flatten out for larger numbers of observations
+    estimator = species_estimator.SpeciesEstimator(d0=True, d1=True, d2=True, c0=True, c1=True,
+                                                   schedule=GeometricSchedule(ratio=1.05))
 
     for s in RETRIVAL_MAP.keys():
         estimator.register(s, RETRIVAL_MAP[s])
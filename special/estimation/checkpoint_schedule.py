@@ -0,0 +1,118 @@
+import math
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from special.estimation.metrics import estimate_species_richness_chao, coverage
+
+if TYPE_CHECKING:
+    from special.estimation.species_estimator import MetricManager
+
+
+class CheckpointSchedule(ABC):
+    """
+    Decides after which observations the profiles of a species definition are updated. Each registered species
+    definition uses its own copy of the schedule, so schedules may keep state between observations
+    """
+
+    @abstractmethod
+    def is_checkpoint(self, metrics: "MetricManager") -> bool:
+        """
+        returns whether the profiles should be updated after the latest observation
+        :param metrics: the metrics of the species definition, including its reference samples and profiles so far
+        :return: true if a checkpoint should be recorded
+        """
+
+
+def last_checkpoint_size(metrics: "MetricManager") -> int:
+    """
+    returns the number of observations at the latest recorded checkpoint
+    :param metrics: the metrics of the species definition
+    :return: the number of observations at the latest checkpoint
+    """
+    return metrics.last_checkpoint_observations
+
+
+class GeometricSchedule(CheckpointSchedule):
+    """
+    Records checkpoints at logarithmically spaced numbers of observations, i.e. each checkpoint is recorded after
+    'ratio' times as many observations as the previous one. Checkpoints are thus dense early on, where the profiles
+    change quickly, and sparse in the flat tail, resulting in O(log n) checkpoints for n observations
+    """
+
+    def __init__(self, ratio: float = 1.05) -> None:
+        """
+        :param ratio: the ratio between the number of observations of two consecutive checkpoints, must exceed 1
+        """
+        if ratio <= 1:
+            raise RuntimeError('The ratio of a geometric schedule must be larger than 1')
+        self.ratio = ratio
+
+    def is_checkpoint(self, metrics: "MetricManager") -> bool:
+        last = last_checkpoint_size(metrics)
+        return metrics.no_observations >= max(last + 1, math.ceil(last * self.ratio))
+
+
+class HybridSchedule(GeometricSchedule):
+    """
+    Records a checkpoint every 'step_size' observations until 'dense_until' observations have been made, and
+    logarithmically spaced checkpoints afterward
+    """
+
+    def __init__(self, step_size: int, dense_until: int, ratio: float = 1.05) -> None:
+        """
+        :param step_size: the number of observations between two checkpoints in the dense part
+        :param dense_until: the number of observations after which checkpoints are spaced logarithmically
+        :param ratio: the ratio between the number of observations of two consecutive checkpoints in the sparse part
+        """
+        super().__init__(ratio)
+        self.step_size = step_size
+        self.dense_until = dense_until
+
+    def is_checkpoint(self, metrics: "MetricManager") -> bool:
+        if metrics.no_observations <= self.dense_until:
+            return metrics.no_observations % self.step_size == 0
+        return super().is_checkpoint(metrics)
+
+
+class ChangeSchedule(CheckpointSchedule):
+    """
+    Records a checkpoint only if the estimated species richness (D0) changed by more than a relative tolerance, or the
+    coverage (C1) changed by more than an absolute tolerance, in either the abundance or the incidence model, since
+    the last checkpoint recorded by this schedule. The number of checkpoints thus follows the information content of
+    the profiles rather than the number of observations
+    """
+
+    def __init__(self, tolerance: float = 0.01, step_size: int = 1) -> None:
+        """
+        :param tolerance: the change in D0 (relative) or C1 (absolute) that triggers a new checkpoint
+        :param step_size: the number of observations after which the change is checked again
+        """
+        self.tolerance = tolerance
+        self.step_size = step_size
+        self.last_values = None
+
+    def is_checkpoint(self, metrics: "MetricManager") -> bool:
+        if metrics.no_observations % self.step_size != 0:
+            return False
+        abundance_sample_size, abundance_frequency_counts = metrics.current_sample("abundance")
+        incidence_sample_size, incidence_frequency_counts = metrics.current_sample("incidence")
+        values = (estimate_species_richness_chao(None, abundance_frequency_counts),
+                  estimate_species_richness_chao(None, incidence_frequency_counts),
+                  coverage(None, abundance_sample_size, abundance_frequency_counts),
+                  coverage(None, incidence_sample_size, incidence_frequency_counts))
+        if self.last_values is not None and not self.__changed(values):
+            return False
+        self.last_values = values
+        return True
+
+    def __changed(self, values: tuple) -> bool:
+        """
+        returns whether D0 or C1 of either model moved by more than the tolerance
+        """
+        for d0, last_d0 in zip(values[:2], self.last_values[:2]):
+            if abs(d0 - last_d0) > self.tolerance * max(last_d0, 1):
+                return True
+        for c1, last_c1 in zip(values[2:], self.last_values[2:]):
+            if abs(c1 - last_c1) > self.tolerance:
+                return True
+        return False
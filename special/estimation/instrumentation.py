@@ -0,0 +1,143 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+# a single context manager that is handed out for every measurement while instrumentation is disabled
+NO_MEASUREMENT = nullcontext()
+
+
+class NullTimer:
+    """
+    Stands in for a PhaseTimer if instrumentation is disabled, all measurements are discarded
+    """
+
+    def measure(self, phase: str, species_id: str | None = None):
+        return NO_MEASUREMENT
+
+    def count_traces(self, no_traces: int = 1) -> None:
+        pass
+
+    def record_growth(self, species_id: str, no_observations: int, no_species: int) -> None:
+        pass
+
+    def merge(self, other) -> None:
+        pass
+
+    def report(self) -> dict:
+        return {}
+
+    def to_text(self) -> str:
+        return ""
+
+
+class PhaseTimer(NullTimer):
+    """
+    Records the cumulative wall-clock and CPU time spent in each phase of the estimation pipeline, e.g. log conversion,
+    species retrieval, counting or the update of a metric, separately for each species definition. Additionally
+    counts the added traces and records the number of distinct species at each checkpoint
+    """
+
+    def __init__(self) -> None:
+        # cumulative [wall time, cpu time, number of calls] per (phase, species id)
+        self.phases = {}
+        self.no_traces = 0
+        # (number of observations, number of species) per checkpoint, for each species definition
+        self.species_growth = {}
+
+    @contextmanager
+    def measure(self, phase: str, species_id: str | None = None):
+        """
+        measures the time spent in the body of a with-statement and adds it to the given phase
+        :param phase: the name of the phase, e.g. "retrieval"
+        :param species_id: the species definition the phase belongs to, or None for phases shared by all of them
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.phases.setdefault((phase, species_id), [0.0, 0.0, 0])
+            totals[0] = totals[0] + time.perf_counter() - wall
+            totals[1] = totals[1] + time.process_time() - cpu
+            totals[2] = totals[2] + 1
+
+    def count_traces(self, no_traces: int = 1) -> None:
+        """
+        counts added traces, from which the throughput is derived
+        :param no_traces: the number of added traces
+        """
+        self.no_traces = self.no_traces + no_traces
+
+    def record_growth(self, species_id: str, no_observations: int, no_species: int) -> None:
+        """
+        records the number of distinct species of a species definition at a checkpoint
+        :param species_id: the species definition
+        :param no_observations: the number of observations at the checkpoint
+        :param no_species: the number of distinct species observed so far
+        """
+        self.species_growth.setdefault(species_id, []).append((no_observations, no_species))
+
+    def merge(self, other: "PhaseTimer") -> None:
+        """
+        adds the measurements of another timer, e.g. of a worker process, to this timer. Added traces are not merged,
+        as workers profile the same traces for different species definitions
+        :param other: the timer to merge
+        """
+        for key, (wall, cpu, calls) in other.phases.items():
+            totals = self.phases.setdefault(key, [0.0, 0.0, 0])
+            totals[0] = totals[0] + wall
+            totals[1] = totals[1] + cpu
+            totals[2] = totals[2] + calls
+        for species_id, growth in other.species_growth.items():
+            self.species_growth.setdefault(species_id, []).extend(growth)
+
+    def report(self) -> dict:
+        """
+        returns the recorded measurements as a structured report
+        :return: the wall time, cpu time and number of calls for each phase and species definition, the number of
+        traces and throughput, and the species growth of each species definition
+        """
+        phases = [{"phase": phase, "species": species_id, "wall_seconds": wall, "cpu_seconds": cpu, "calls": calls}
+                  for (phase, species_id), (wall, cpu, calls) in self.phases.items()]
+        profiling_time = sum(wall for (phase, _), (wall, _, _) in self.phases.items() if phase == "profiling")
+        return {
+            "phases": phases,
+            "traces": self.no_traces,
+            "traces_per_second": self.no_traces / profiling_time if profiling_time > 0 else 0,
+            "species_growth": {species_id: list(growth) for species_id, growth in self.species_growth.items()}
+        }
+
+    def to_text(self) -> str:
+        """
+        returns the recorded measurements in the plain-text exposition format of Prometheus, e.g. to be scraped from a
+        local endpoint or file
+        :return: the measurements, one sample per line
+        """
+        lines = []
+        for name, index, description in [("special_phase_wall_seconds_total", 0, "Cumulative wall-clock time"),
+                                         ("special_phase_cpu_seconds_total", 1, "Cumulative CPU time"),
+                                         ("special_phase_calls_total", 2, "Number of measured calls")]:
+            lines.append("# HELP " + name + " " + description + " per phase and species definition")
+            lines.append("# TYPE " + name + " counter")
+            for (phase, species_id), totals in self.phases.items():
+                lines.append(name + _labels(phase=phase, species=species_id) + " " + str(totals[index]))
+        report = self.report()
+        lines.append("# HELP special_traces_total Number of added traces")
+        lines.append("# TYPE special_traces_total counter")
+        lines.append("special_traces_total " + str(report["traces"]))
+        lines.append("# HELP special_traces_per_second Throughput of profiling")
+        lines.append("# TYPE special_traces_per_second gauge")
+        lines.append("special_traces_per_second " + str(report["traces_per_second"]))
+        lines.append("# HELP special_species Number of distinct species at the latest checkpoint")
+        lines.append("# TYPE special_species gauge")
+        for species_id, growth in self.species_growth.items():
+            lines.append("special_species" + _labels(species=species_id) + " " + str(growth[-1][1]))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels) -> str:
+    """
+    formats labels of a sample, omitting labels without value
+    """
+    escaped = [name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for name, value in labels.items() if value is not None]
+    return "{" + ",".join(escaped) + "}" if escaped else ""
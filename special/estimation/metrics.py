@@ -1,105 +1,180 @@
 import math
+from collections import Counter
 
 import mpmath
+import numpy as np
 from numpy import euler_gamma
-from scipy.special import digamma
+from scipy.special import digamma, exp1, gammaln
 
 from cachetools import cached
 
+# harmonic numbers H_0,...,H_100, shared by all entropy estimations
+HARMONIC_TABLE = np.concatenate(([0.0], np.cumsum(1 / np.arange(1, 101)))).tolist()
+
+
+def get_frequency_counts(obs_species_counts: dict | np.ndarray) -> dict:
+    """
+    returns the frequency counts of the reference sample, i.e. for each incidence count k the number of species f_k
+    that have an incidence count of k
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :return: the frequency counts f_k of the reference sample
+    """
+    if isinstance(obs_species_counts, np.ndarray):
+        k, f_k = np.unique(obs_species_counts[obs_species_counts > 0], return_counts=True)
+        return dict(zip(k.tolist(), f_k.tolist()))
+    return dict(Counter(obs_species_counts.values()))
+
+
+def _frequency_counts(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None) -> dict:
+    """
+    returns the given frequency counts, or derives them from the reference sample if none are given
+    """
+    if frequency_counts is not None:
+        return frequency_counts
+    return get_frequency_counts(obs_species_counts)
+
 
 #TODO unify incidence and abundance-based methods in one function
-def get_incidence_count(obs_species_counts: dict, i: int) -> int:
+def get_incidence_count(obs_species_counts: dict | np.ndarray, i: int, frequency_counts: dict | None = None) -> int:
     """
     returns the number of species, that have an incidence count of i
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param i: the incidence count
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the number of species with incidence count i
     """
+    if frequency_counts is not None:
+        return frequency_counts.get(i, 0)
+    if isinstance(obs_species_counts, np.ndarray):
+        return int(np.count_nonzero(obs_species_counts == i))
     return list(obs_species_counts.values()).count(i)
 
 
-def get_singletons(obs_species_counts: dict) -> int:
+def get_singletons(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None) -> int:
     """
     returns the number of singletons species, i.e. those species that have an incidence count of 1
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the number of species with incidence count 1
     """
-    return list(obs_species_counts.values()).count(1)
+    return get_incidence_count(obs_species_counts, 1, frequency_counts)
 
 
-def get_doubletons(obs_species_counts: dict) -> int:
+def get_doubletons(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None) -> int:
     """
     returns the number of doubleton species, i.e. those species that have an incidence count of 2
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the number of species with incidence count 2
     """
-    return list(obs_species_counts.values()).count(2)
+    return get_incidence_count(obs_species_counts, 2, frequency_counts)
 
 
-def get_number_observed_species(obs_species_counts: dict) -> int:
+def get_number_observed_species(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None) -> int:
     """
     returns the number of observed species
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the number of observed species
     """
+    if frequency_counts is not None:
+        return sum(frequency_counts.values())
+    if isinstance(obs_species_counts, np.ndarray):
+        return int(np.count_nonzero(obs_species_counts))
     return len(obs_species_counts.keys())
 
 
-def get_total_species_count(obs_species_counts):
+def get_total_species_count(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None):
     """
     returns the total number of species incidences, i.e. the sum of all species incidences in the reference sample
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the sum of species incidences
     """
+    if frequency_counts is not None:
+        return sum(k * f_k for k, f_k in frequency_counts.items())
+    if isinstance(obs_species_counts, np.ndarray):
+        return int(obs_species_counts.sum())
     return sum(obs_species_counts.values())
 
 
-def hill_number(d: int, obs_species_counts: dict) -> float:
+def hill_number(d: int, obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None) -> float:
     """
     computes sample-based Hill number of order d for the reference sample.
     D=0 - species richness
     D=1 - Exponential of Shannon entropy
     D=2 - Simpson Diversity Index
     :param d: the order of the Hill number
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the sample-based Hill number of order d
     """
     # sample-based species richness
     if d == 0:
-        return get_number_observed_species(obs_species_counts)
+        return get_number_observed_species(obs_species_counts, frequency_counts)
     # sample-based exponential Shannon diversity
     if d == 1:
-        return entropy_exp(obs_species_counts)
+        return entropy_exp(obs_species_counts, frequency_counts)
     # sample-based Simpson diversity
     if d == 2:
-        return simpson_diversity(obs_species_counts)
+        return simpson_diversity(obs_species_counts, frequency_counts)
 
 
-def entropy_exp(obs_species_counts: dict) -> float:
+def entropy_exp(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None) -> float:
     """
     computes the exponential of Shannon entropy
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the exponential of Shannon entropy
     """
-    total_species_count = get_total_species_count(obs_species_counts)
-    # total = sum([obs_species_counts.values])
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    total_species_count = get_total_species_count(obs_species_counts, f)
+    # species with equal counts contribute equally, hence it suffices to sum over the frequency counts
     return math.exp(-1 * sum(
-        [x / total_species_count * math.log(x / total_species_count) for x in obs_species_counts.values()]))
+        [f_k * (k / total_species_count * math.log(k / total_species_count)) for k, f_k in f.items()]))
 
 
-def simpson_diversity(obs_species_counts: dict) -> float:
+def simpson_diversity(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None) -> float:
     """
     computes the Simpson diversity index
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the Simpson diversity index
     """
-    total_species_count = get_total_species_count(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    total_species_count = get_total_species_count(obs_species_counts, f)
 
-    a = sum([(x / total_species_count) ** 2 for x in obs_species_counts.values()])
+    a = sum([f_k * (k / total_species_count) ** 2 for k, f_k in f.items()])
     # TODO check if return 1 is reasonable
     return a ** (1 / (1 - 2)) if a > 0 else 1
 
 
+def entropy_exp_from_sums(sum_x_log_x: float, total_species_count: int) -> float:
+    """
+    computes the exponential of Shannon entropy from a running sum over the species counts, which allows reading it
+    without scanning the species. Equivalent to entropy_exp
+    :param sum_x_log_x: the sum of x*log(x) over all species counts x
+    :param total_species_count: the sum of all species counts
+    :return: the exponential of Shannon entropy
+    """
+    if total_species_count == 0:
+        return 1
+    # sum(x/Y * log(x/Y)) = sum(x*log(x))/Y - log(Y)
+    return math.exp(math.log(total_species_count) - sum_x_log_x / total_species_count)
+
+
+def simpson_diversity_from_sums(sum_squares: int, total_species_count: int) -> float:
+    """
+    computes the Simpson diversity index from a running sum over the species counts, which allows reading it
+    without scanning the species. Equivalent to simpson_diversity
+    :param sum_squares: the sum of x^2 over all species counts x
+    :param total_species_count: the sum of all species counts
+    :return: the Simpson diversity index
+    """
+    if sum_squares == 0:
+        return 1
+    return total_species_count ** 2 / sum_squares
+
 '''
 Calculate asymptotic Hill number of order d for a reference sample
 d=0 Species Richness
@@ -108,49 +183,54 @@ d=2 Simpson Diversity Index
 '''
 
 
-def hill_number_asymptotic(d: int, obs_species_counts: dict, sample_size: int, abundance: bool = True) -> float:
+def hill_number_asymptotic(d: int, obs_species_counts: dict | np.ndarray, sample_size: int, abundance: bool = True,
+                           frequency_counts: dict | None = None) -> float:
     """
     computes asymptotic Hill number of order d for the reference sample, for either abundance data or incidence data.
     D=0 - asymptotic species richness
     D=1 - asymptotic exponential of Shannon entropy
     D=2 - asymptotic Simpson diversity index
     :param d: the order of the Hill number
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
     :param abundance: flag indicating the data type. Setting this 'True' indicates abundance-based data,
     setting this 'False' indicates incidence-based data
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the asymptotic Hill number of order d
     """
     # asymptotic species richness
     # for species richness, there is no differentiation between abundance and incidence
     if d == 0:
-        return estimate_species_richness_chao(obs_species_counts)
+        return estimate_species_richness_chao(obs_species_counts, frequency_counts)
     # asymptotic Shannon entropy
     if d == 1:
         if abundance:
-            return estimate_exp_shannon_entropy_abundance(obs_species_counts, sample_size)
+            return estimate_exp_shannon_entropy_abundance(obs_species_counts, sample_size, frequency_counts)
         # incidence
         else:
-            return estimate_exp_shannon_entropy_incidence(obs_species_counts, sample_size)
+            return estimate_exp_shannon_entropy_incidence(obs_species_counts, sample_size, frequency_counts)
     # asymptotic Simpson diversity
     if d == 2:
         if abundance:
-            return estimate_simpson_diversity_abundance(obs_species_counts, sample_size)
+            return estimate_simpson_diversity_abundance(obs_species_counts, sample_size, frequency_counts)
         # incidence
         else:
-            return estimate_simpson_diversity_incidence(obs_species_counts, sample_size)
+            return estimate_simpson_diversity_incidence(obs_species_counts, sample_size, frequency_counts)
 
 
-def estimate_species_richness_chao(obs_species_counts: dict) -> float:
+def estimate_species_richness_chao(obs_species_counts: dict | np.ndarray,
+                                   frequency_counts: dict | None = None) -> float:
     """
     computes the asymptotic(=estimated) species richness using the Chao1 estimator(for abundance data)
     or Chao2 estimator (for incidence data)
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated species richness
     """
-    obs_species_count = get_number_observed_species(obs_species_counts)
-    f_1 = get_singletons(obs_species_counts)
-    f_2 = get_doubletons(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    obs_species_count = get_number_observed_species(obs_species_counts, f)
+    f_1 = get_singletons(obs_species_counts, f)
+    f_2 = get_doubletons(obs_species_counts, f)
 
     if f_2 != 0:
         return obs_species_count + f_1 ** 2 / (2 * f_2)
@@ -158,16 +238,19 @@ def estimate_species_richness_chao(obs_species_counts: dict) -> float:
         return obs_species_count + f_1 * (f_1 - 1) / 2
 
 
-def estimate_species_richness_chao_corrected(obs_species_counts: dict) -> float:
+def estimate_species_richness_chao_corrected(obs_species_counts: dict | np.ndarray,
+                                             frequency_counts: dict | None = None) -> float:
     """
     computes the asymptotic(=estimated) species richness using the Chao1 estimator(for abundance data)
     or Chao2 estimator (for incidence data). Includes a correction term for very small sample sizes
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated species richness
     """
-    obs_species_count = get_number_observed_species(obs_species_counts)
-    f_1 = get_singletons(obs_species_counts)
-    f_2 = get_doubletons(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    obs_species_count = get_number_observed_species(obs_species_counts, f)
+    f_1 = get_singletons(obs_species_counts, f)
+    f_2 = get_doubletons(obs_species_counts, f)
 
     if f_2 != 0:
         return ((obs_species_count - 1) / obs_species_count) * obs_species_count + f_1 ** 2 / (2 * f_2)
@@ -175,68 +258,67 @@ def estimate_species_richness_chao_corrected(obs_species_counts: dict) -> float:
         return ((obs_species_count - 1) / obs_species_count) * obs_species_count + f_1 * (f_1 - 1) / 2
 
 
-def estimate_exp_shannon_entropy_abundance(obs_species_counts: dict, sample_size: int) -> float:
+def estimate_exp_shannon_entropy_abundance(obs_species_counts: dict | np.ndarray, sample_size: int,
+                                           frequency_counts: dict | None = None) -> float:
     """
     computes the asymptotic(=estimated) exponential of Shannon entropy for abundance-based data
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated exponential of Shannon entropy
     """
-    return math.exp(estimate_entropy(obs_species_counts, sample_size))
+    return math.exp(estimate_entropy(obs_species_counts, sample_size, frequency_counts))
 
 
-def estimate_exp_shannon_entropy_incidence(obs_species_counts: dict, sample_size: int) -> float:
+def estimate_exp_shannon_entropy_incidence(obs_species_counts: dict | np.ndarray, sample_size: int,
+                                           frequency_counts: dict | None = None) -> float:
     """
     computes the asymptotic(=estimated) exponential of Shannon entropy for incidence-based data
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated exponential of Shannon entropy
     """
+    f = _frequency_counts(obs_species_counts, frequency_counts)
     # term h_o is structurally equivalent to abundance based entropy estimation, see eq H7 in appendix H of Hill number paper
-    u = sum(obs_species_counts.values())
-    h_o = estimate_entropy(obs_species_counts, sample_size)
+    u = get_total_species_count(obs_species_counts, f)
+    h_o = estimate_entropy(obs_species_counts, sample_size, f)
 
     return math.exp((sample_size / u) * h_o + math.log(u / sample_size))
 
 
-def estimate_entropy(obs_species_counts: dict, sample_size: int) -> float:
+def estimate_entropy(obs_species_counts: dict | np.ndarray, sample_size: int,
+                     frequency_counts: dict | None = None) -> float:
     """
     computes the estimated Shannon entropy
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated exponential of Shannon entropy
     """
-    # TODO make this understandable
-    f_1 = get_singletons(obs_species_counts)
-    f_2 = get_doubletons(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    f_1 = get_singletons(obs_species_counts, f)
+    f_2 = get_doubletons(obs_species_counts, f)
 
-    entropy_known_species = 0
+    # species with equal counts contribute equally, hence it suffices to sum over the frequency counts.
+    # sum(1/x_i,...,1/sample_size) is decomposed to sum(1/1,...,1/sample_size)-sum(1/1,...,1/x_i-1)
+    harmonic_sample_size = harmonic(sample_size)
+    entropy_known_species = sum(f_x * (x_i / sample_size) * (harmonic_sample_size - harmonic(x_i - 1))
+                                for x_i, f_x in f.items() if x_i <= sample_size - 1)
 
-    for x_i in obs_species_counts.values():
-        if x_i <= sample_size - 1:
-            norm_factor = x_i / sample_size
-
-            #decompose sum(1/x_i,...,1/sample_size) to um(1/1,...,1/sample_size)-sum(1/1,...,1/x_i-1)
-            entropy_known_species = entropy_known_species + norm_factor * (harmonic(sample_size) - harmonic(x_i-1))
-            #entropy_known_species = entropy_known_species + norm_factor * (mpmath.harmonic(sample_size) - mpmath.harmonic(x_i-1))
-            #entropy_known_species = entropy_known_species + norm_factor * sum([1 / k for k in range(x_i, sample_size)])
-
-    a = 0
     if f_2 > 0:
         a = (2 * f_2) / ((sample_size - 1) * f_1 + 2 * f_2)
-    if f_2 == 0 and f_1 > 0:
+    elif f_1 > 0:
         a = 2 / ((sample_size - 1) * (f_1 - 1) + 2)
     else:
         a = 1
 
-    entropy_unknown_species = 0
-
-    # TODO rethink if this is really necessary
-    if a == 1:
+    # without singletons, or for a=1, there is no contribution of unseen species
+    if f_1 == 0 or a == 1:
         return entropy_known_species
 
-    entropy_unknown_species = (f_1 / sample_size) * ((1 - a) ** (-sample_size + 1)) * (
-            -math.log(a) - sum([(1 / r) * ((1 - a) ** r) for r in range(1, sample_size)]))
+    # sum((1-a)^(j+1)/(sample_size+j)) equals (1-a)^(1-sample_size) * (-log(a) - sum((1-a)^r/r, r<sample_size))
+    entropy_unknown_species = (f_1 / sample_size) * entropy_tail(np.array([sample_size]), np.array([a]))[0]
 
     return entropy_known_species + entropy_unknown_species
 
@@ -248,77 +330,87 @@ def harmonic(n):
     taken from: https://stackoverflow.com/questions/404346/python-program-to-calculate-harmonic-series
      """
     if n <= 100:
-        return sum(1/k for k in range(1,n+1))
+        return HARMONIC_TABLE[int(n)]
     else:
         return digamma(n + 1) + euler_gamma
 
 
-def estimate_simpson_diversity_abundance(obs_species_counts: dict, sample_size: int) -> float:
+def estimate_simpson_diversity_abundance(obs_species_counts: dict | np.ndarray, sample_size: int,
+                                         frequency_counts: dict | None = None) -> float:
     """
     computes the asymptotic(=estimated) Simpson diversity for abundance-based data
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated Simpson diversity
     """
     # TODO make this understandable
+    f = _frequency_counts(obs_species_counts, frequency_counts)
     denom = 0
-    for x_i in obs_species_counts.values():
+    for x_i, f_x in f.items():
         if x_i >= 2:
-            denom = denom + (x_i * (x_i - 1))
+            denom = denom + f_x * (x_i * (x_i - 1))
     if denom == 0:
         return 0
     return (sample_size * (sample_size - 1)) / denom
 
 
-def estimate_simpson_diversity_incidence(obs_species_counts: dict, sample_size: int) -> float:
+def estimate_simpson_diversity_incidence(obs_species_counts: dict | np.ndarray, sample_size: int,
+                                         frequency_counts: dict | None = None) -> float:
     """
     computes the asymptotic(=estimated) Simpson diversity for incidence-based data
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated Simpson diversity
     """
     # TODO make this understandable
-    u = get_total_species_count(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    u = get_total_species_count(obs_species_counts, f)
     s = 0
 
     nom = ((1 - (1 / sample_size)) * u) ** 2
 
-    for y_i in obs_species_counts.values():
+    for y_i, f_y in f.items():
         if y_i > 1:
             #    s = s + (sample_size ** 2 * y_i ** 2) / (u ** 2 * sample_size ** 2)
-            s = s + (y_i * (y_i - 1))
+            s = s + f_y * (y_i * (y_i - 1))
     if s == 0:
         return 0
     # return s ** (1 / (1 - 2))
     return nom / s
 
 
-def completeness(obs_species_counts: dict) -> float:
+def completeness(obs_species_counts: dict | np.ndarray, frequency_counts: dict | None = None) -> float:
     """
     computes the completeness of the sample data. A value of '1' indicates full completeness,
     whereas as value of '0' indicates total incompleteness
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated completeness
     """
-    obs_species_count = get_number_observed_species(obs_species_counts)
-    s_P = estimate_species_richness_chao(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    obs_species_count = get_number_observed_species(obs_species_counts, f)
+    s_P = estimate_species_richness_chao(obs_species_counts, f)
     if s_P == 0:
         return 0
 
     return obs_species_count / s_P
 
 
-def coverage(obs_species_counts: dict, sample_size: int) -> float:
+def coverage(obs_species_counts: dict | np.ndarray, sample_size: int, frequency_counts: dict | None = None) -> float:
     """
     computes the coverage of the sample data. A value of '1' indicates full coverage,
     whereas as value of '0' indicates no coverage
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the estimated coverage
     """
-    f_1 = get_singletons(obs_species_counts)
-    f_2 = get_doubletons(obs_species_counts)
-    Y = get_total_species_count(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    f_1 = get_singletons(obs_species_counts, f)
+    f_2 = get_doubletons(obs_species_counts, f)
+    Y = get_total_species_count(obs_species_counts, f)
 
     if sample_size == 0:
         return 0
@@ -330,25 +422,28 @@ def coverage(obs_species_counts: dict, sample_size: int) -> float:
     return 1 - f_1 / Y * (((sample_size - 1) * f_1) / ((sample_size - 1) * f_1 + 2 * f_2))
 
 
-def sampling_effort_abundance(n: float, obs_species_counts: dict, sample_size: int) -> float:
+def sampling_effort_abundance(n: float, obs_species_counts: dict | np.ndarray, sample_size: int,
+                              frequency_counts: dict | None = None) -> float:
     """
     computes the expected additional sampling effort needed to reach target completeness l for abundance data.
     If f exceeds the current completeness, this function returns 0
     :param n: desired target completeness
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the expected additional sampling effort
     """
-    comp = completeness(obs_species_counts)
-    f_1 = get_singletons(obs_species_counts)
-    f_2 = get_doubletons(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    comp = completeness(obs_species_counts, f)
+    f_1 = get_singletons(obs_species_counts, f)
+    f_2 = get_doubletons(obs_species_counts, f)
 
     if n <= comp:
         return 0
     if f_2 == 0:
         return 0
 
-    obs_species_count = estimate_species_richness_chao(obs_species_counts)
+    obs_species_count = estimate_species_richness_chao(obs_species_counts, f)
     #get_number_observed_species(obs_species_counts))
 
     s_P = 0
@@ -360,25 +455,28 @@ def sampling_effort_abundance(n: float, obs_species_counts: dict, sample_size: i
     return ((sample_size * f_1) / (2 * f_2)) * math.log(s_P / ((1 - n) * (s_P + obs_species_count)))
 
 
-def sampling_effort_incidence(n: float, obs_species_counts: dict, sample_size: int) -> float:
+def sampling_effort_incidence(n: float, obs_species_counts: dict | np.ndarray, sample_size: int,
+                              frequency_counts: dict | None = None) -> float:
     """
     computes the expected additional sampling effort needed to reach target completeness l for incidence data.
     If f exceeds the current completeness, this function returns 0
     :param n: desired target completeness
-    :param obs_species_counts: the species with corresponding incidence counts
+    :param obs_species_counts: the species with corresponding incidence counts, or an array of species counts
     :param sample_size: the sample size associated with the species incidence counts
+    :param frequency_counts: the frequency counts f_k of the reference sample. If set, the species are not scanned
     :return: the expected additional sampling effort
     """
-    comp = completeness(obs_species_counts)
-    f_1 = get_singletons(obs_species_counts)
-    f_2 = get_doubletons(obs_species_counts)
+    f = _frequency_counts(obs_species_counts, frequency_counts)
+    comp = completeness(obs_species_counts, f)
+    f_1 = get_singletons(obs_species_counts, f)
+    f_2 = get_doubletons(obs_species_counts, f)
     if n <= comp or sample_size < 2:
         return 0
     if f_2 == 0:
         return 0
 
     # for small sample sizes, correction term is introduced, otherwise math error
-    obs_species_count = estimate_species_richness_chao(obs_species_counts)
+    obs_species_count = estimate_species_richness_chao(obs_species_counts, f)
     #obs_species_count = get_number_observed_species(obs_species_counts)
 
     s_P = 0
@@ -396,3 +494,175 @@ def sampling_effort_incidence(n: float, obs_species_counts: dict, sample_size: i
     denominator = (math.log(1 - ((2 * f_2) / ((sample_size - 1) * f_1 + 2 * f_2))))
 
     return nom / denominator
+
+
+def harmonic_numbers(n: np.ndarray) -> np.ndarray:
+    """
+    vectorised version of harmonic, returns the n-th harmonic number for each entry of n
+    :param n: the indices of the harmonic numbers
+    :return: the harmonic numbers
+    """
+    n = np.asarray(n)
+    return np.where(n <= 100, np.take(HARMONIC_TABLE, np.clip(n, 0, 100).astype(int)), digamma(n + 1) + euler_gamma)
+
+
+def entropy_tail(sample_size: np.ndarray, a: np.ndarray) -> np.ndarray:
+    """
+    computes the series sum(x^(j+1)/(n+j), j=0,1,...) with x=1-a, which is the contribution of unseen species to the
+    estimated Shannon entropy, up to a factor f_1/n. The series is equivalent to
+    (1-a)^(1-n) * (-log(a) - sum((1-a)^r/r, r=1,...,n-1)), which suffers from cancellation for large n. Depending on
+    n and a, the series is summed directly, expanded around x=1 or approximated by its integral using Euler-Maclaurin
+    summation
+    :param sample_size: the sample sizes n
+    :param a: the values of a, with 0 < a < 1
+    :return: the value of the series for each pair of n and a
+    """
+    n = np.asarray(sample_size, dtype=float)
+    a = np.asarray(a, dtype=float)
+    x = 1 - a
+    tail = np.zeros(len(n))
+
+    # the series converges quickly
+    direct = a >= 0.01
+    for i in np.flatnonzero(direct):
+        j = np.arange(int(np.ceil(40 / a[i])) + 1)
+        tail[i] = (x[i] ** (j + 1) / (n[i] + j)).sum()
+
+    # for small n, use the expansion of 2F1(1,n;n+1;x) around x=1
+    expansion = ~direct & (n < 500)
+    if expansion.any():
+        k = np.arange(100)
+        n_e = n[expansion, None]
+        a_e = a[expansion, None]
+        terms = np.exp(gammaln(n_e + k) - gammaln(n_e) - gammaln(k + 1) + k * np.log(a_e)) * (
+                digamma(k + 1) - digamma(n_e + k) - np.log(a_e))
+        tail[expansion] = x[expansion] * terms.sum(axis=1)
+
+    # for large n, the summands e^(-bj)/(n+j) vary slowly in j, hence the sum is well approximated by its integral
+    euler_maclaurin = ~direct & ~expansion
+    if euler_maclaurin.any():
+        n_m = n[euler_maclaurin]
+        b = -np.log1p(-a[euler_maclaurin])
+        z = b * n_m
+        # the integral equals e^z * E1(z), for large z use its asymptotic expansion
+        integral = np.empty(len(z))
+        small = z <= 700
+        integral[small] = np.exp(z[small]) * exp1(z[small])
+        integral[~small] = sum((-1) ** m * math.factorial(m) / z[~small] ** (m + 1) for m in range(10))
+
+        def derivative(m: int) -> np.ndarray:
+            # m-th derivative of the summands at j=0
+            return sum(math.comb(m, i) * (-b) ** (m - i) * (-1) ** i * math.factorial(i) / n_m ** (i + 1)
+                       for i in range(m + 1))
+
+        tail[euler_maclaurin] = x[euler_maclaurin] * (
+                integral + 0.5 / n_m - derivative(1) / 12 + derivative(3) / 720 - derivative(5) / 30240)
+    return tail
+
+
+def frequency_count_matrix(frequency_counts: list) -> tuple:
+    """
+    stacks the frequency counts of several reference samples, e.g. of the checkpoints of a profile, into a matrix
+    :param frequency_counts: the frequency counts f_k of the reference samples
+    :return: the incidence counts k present in any of the reference samples, and a matrix with one row per reference
+    sample and one column per incidence count, holding the frequency counts f_k
+    """
+    k = np.array(sorted(set().union(*frequency_counts)), dtype=np.int64)
+    columns = {count: i for i, count in enumerate(k.tolist())}
+    matrix = np.zeros((len(frequency_counts), len(k)))
+    for row, f in enumerate(frequency_counts):
+        matrix[row, [columns[count] for count in f]] = list(f.values())
+    return k, matrix
+
+
+def batch_metrics(metrics: list, k: np.ndarray, frequency_counts: np.ndarray, sample_sizes: np.ndarray,
+                  abundance: bool = True) -> dict:
+    """
+    computes diversity and completeness metrics for many reference samples at once, e.g. for all checkpoints of a
+    profile. Each metric is evaluated as in its scalar counterpart, but for all reference samples in a few array
+    operations over the frequency counts
+    :param metrics: the metrics to compute, any of "sample_d0", "sample_d1", "sample_d2", "estimate_d0",
+    "estimate_d1", "estimate_d2", "c0", "c1" and "l_<g>" for a target completeness g
+    :param k: the incidence counts, one per column of frequency_counts
+    :param frequency_counts: the frequency counts f_k, with one row per reference sample, as returned by
+    frequency_count_matrix
+    :param sample_sizes: the sample size of each reference sample
+    :param abundance: flag indicating the data type. Setting this 'True' indicates abundance-based data,
+    setting this 'False' indicates incidence-based data
+    :return: the values of each metric, with one entry per reference sample
+    """
+    k = np.asarray(k, dtype=float)
+    f = np.asarray(frequency_counts, dtype=float)
+    n = np.asarray(sample_sizes, dtype=float)
+
+    f_1 = f[:, k == 1].sum(axis=1)
+    f_2 = f[:, k == 2].sum(axis=1)
+    obs_species_count = f.sum(axis=1)
+    total_species_count = f @ k
+    chao = np.where(f_2 != 0, obs_species_count + f_1 ** 2 / np.where(f_2 != 0, 2 * f_2, 1),
+                    obs_species_count + f_1 * (f_1 - 1) / 2)
+    comp = np.where(chao == 0, 0, obs_species_count / np.where(chao == 0, 1, chao))
+
+    results = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for metric in metrics:
+            if metric == "sample_d0":
+                results[metric] = obs_species_count
+            elif metric == "sample_d1":
+                # sum(f_k * k/Y * log(k/Y)) = sum(f_k * k * log(k))/Y - log(Y)
+                entropy = (f @ (k * np.log(k))) / total_species_count - np.log(total_species_count)
+                results[metric] = np.where(total_species_count > 0, np.exp(-entropy), 1)
+            elif metric == "sample_d2":
+                a = (f @ k ** 2) / total_species_count ** 2
+                results[metric] = np.where(total_species_count > 0, 1 / a, 1)
+            elif metric == "estimate_d0":
+                results[metric] = chao
+            elif metric == "estimate_d1":
+                h_o = _batch_entropy(k, f, n, f_1, f_2)
+                if abundance:
+                    results[metric] = np.exp(h_o)
+                else:
+                    results[metric] = np.exp((n / total_species_count) * h_o + np.log(total_species_count / n))
+            elif metric == "estimate_d2":
+                s = f @ (k * (k - 1))
+                nom = n * (n - 1) if abundance else ((1 - (1 / n)) * total_species_count) ** 2
+                results[metric] = np.where(s == 0, 0, nom / np.where(s == 0, 1, s))
+            elif metric == "c0":
+                results[metric] = comp
+            elif metric == "c1":
+                value = 1 - f_1 / total_species_count * (((n - 1) * f_1) / ((n - 1) * f_1 + 2 * f_2))
+                value = np.where((f_1 == 0) & (f_2 == 0), 1, value)
+                results[metric] = np.where((n == 0) | ((f_2 == 0) & (n == 1)), 0, value)
+            elif metric.startswith("l_"):
+                g = float(metric[2:])
+                if abundance:
+                    s_P = f_1 ** 2 / (2 * f_2)
+                    value = ((n * f_1) / (2 * f_2)) * np.log(s_P / ((1 - g) * (s_P + chao)))
+                    results[metric] = np.where((g <= comp) | (f_2 == 0), 0, value)
+                else:
+                    s_P = chao + (1 - 1 / n) * f_1 ** 2 / (2 * f_2)
+                    nom = np.log(1 - (n / (n - 1)) * ((2 * f_2) / (f_1 ** 2)) * (g * s_P - chao))
+                    denominator = np.log(1 - ((2 * f_2) / ((n - 1) * f_1 + 2 * f_2)))
+                    results[metric] = np.where((g <= comp) | (n < 2) | (f_2 == 0), 0, nom / denominator)
+            else:
+                raise RuntimeError('Cannot evaluate unknown metric ' + metric)
+    return results
+
+
+def _batch_entropy(k: np.ndarray, f: np.ndarray, n: np.ndarray, f_1: np.ndarray, f_2: np.ndarray) -> np.ndarray:
+    """
+    vectorised version of estimate_entropy, computes the estimated Shannon entropy for each row of frequency counts
+    """
+    # sum(f_k * k/n * (H(n) - H(k-1))) over k <= n-1, where k is sorted in ascending order
+    known = k[None, :] <= n[:, None] - 1
+    f_known = np.where(known, f, 0)
+    entropy = np.zeros(len(n))
+    np.divide(harmonic_numbers(n) * (f_known @ k) - f_known @ (k * harmonic_numbers(k - 1)), n, out=entropy,
+              where=n > 0)
+
+    a = np.where(f_2 > 0, (2 * f_2) / ((n - 1) * f_1 + 2 * f_2),
+                 np.where(f_1 > 0, 2 / ((n - 1) * (f_1 - 1) + 2), 1))
+    unseen = (f_1 > 0) & (a < 1)
+    if unseen.any():
+        entropy[unseen] = entropy[unseen] + (f_1[unseen] / n[unseen]) * entropy_tail(n[unseen], a[unseen])
+    return entropy
@@ -0,0 +1,311 @@
+import importlib
+import json
+import os
+import struct
+from functools import partial
+from types import FunctionType, BuiltinFunctionType
+from typing import Callable
+
+import numpy as np
+
+from special.estimation.species_estimator import SpeciesEstimator, MetricManager, DecayedMetricManager, \
+    BoundedMetricManager
+from special.estimation.species_vocabulary import SpeciesVocabulary
+from special.estimation.windowed_species_estimator import WindowedSpeciesEstimator
+
+# the file starts with the magic bytes, the format version and the length of the JSON header, followed by the header
+# and the raw arrays, each of which starts at an aligned offset so that it can be memory-mapped
+MAGIC = b"SPECIAL\x00"
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct("<8sIIQ")
+ALIGNMENT = 64
+
+# scalar attributes of a metric manager that are stored in the header
+MANAGER_SCALARS = ["incidence_current_total_species_count", "abundance_current_total_species_count",
+                   "incidence_sample_size", "abundance_sample_size", "current_spatial_aggregation",
+                   "abundance_sum_x_log_x", "incidence_sum_x_log_x", "abundance_sum_squares",
+                   "incidence_sum_squares", "no_checkpoints", "lazy", "evaluated_checkpoints",
+                   "closing_checkpoint"]
+DECAYED_MANAGER_SCALARS = ["decay", "prune_below", "time", "reference_time", "observation_weight",
+                           "checkpoint_times"]
+BOUNDED_MANAGER_SCALARS = ["max_species", "compaction_limit", "sketch_width", "no_demoted"]
+BOUNDED_FREQUENCY_COUNTS = ["exact_abundance_frequency_counts", "exact_incidence_frequency_counts"]
+BOUNDED_SEGMENT_FREQUENCY_COUNTS = ["tail_abundance_frequency_counts", "tail_incidence_frequency_counts"]
+ESTIMATOR_SCALARS = ["include_d0", "include_d1", "include_d2", "include_c0", "include_c1", "l_n", "step_size",
+                     "n_jobs", "lazy", "decay", "max_species", "deduplicate"]
+
+
+def save_estimator(estimator: SpeciesEstimator, path: str) -> None:
+    """
+    writes an estimator, including the vocabulary, species counts, checkpoint series and configuration of each
+    species definition, to a versioned binary file
+    :param estimator: the estimator to save
+    :param path: the path of the file
+    """
+    if isinstance(estimator, WindowedSpeciesEstimator):
+        raise RuntimeError('Cannot save windowed estimators')
+    arrays = []
+    header = {attribute: getattr(estimator, attribute) for attribute in ESTIMATOR_SCALARS}
+    header["schedule"] = _object_spec(estimator.schedule)
+    header["species"] = {}
+    # objects referenced by several species retrieval functions, by id, e.g. an NGramOrders instance
+    shared = {}
+    for species_id, manager in estimator.metrics.items():
+        header["species"][species_id] = {
+            "retrieval": _function_spec(estimator.species_retrieval[species_id], shared),
+            "schedule": _object_spec(estimator.schedules.get(species_id)),
+            "manager": _manager_spec(manager, arrays)
+        }
+    header["shared"] = list(shared.values())
+
+    layout = []
+    offset = 0
+    for array in arrays:
+        layout.append([array.dtype.str, list(array.shape), offset])
+        offset = _align(offset + array.nbytes)
+    header["arrays"] = layout
+    encoded_header = json.dumps(header).encode("utf-8")
+    data_offset = _align(PREAMBLE.size + len(encoded_header))
+
+    # the file is replaced at once, as estimators loaded from it may still map its previous contents
+    temporary_path = str(path) + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(encoded_header)))
+        file.write(encoded_header)
+        for array, (_, _, array_offset) in zip(arrays, layout):
+            file.seek(data_offset + array_offset)
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_offset + offset)
+    os.replace(temporary_path, path)
+
+
+def load_estimator(path: str, species_retrieval: dict | None = None) -> SpeciesEstimator:
+    """
+    reads an estimator from a file written by save_estimator. Count arrays and checkpoint series are memory-mapped
+    copy-on-write, hence only the parts that are accessed are read, and the file is never modified
+    :param path: the path of the file
+    :param species_retrieval: species retrieval functions by species id, replacing the stored references. Required
+    for functions that cannot be imported by name, e.g. lambdas
+    :return: the loaded estimator
+    """
+    species_retrieval = species_retrieval or {}
+    with open(path, "rb") as file:
+        magic, version, _, header_length = PREAMBLE.unpack(file.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise RuntimeError('Not a SpeciesEstimator file: ' + str(path))
+        if version > FORMAT_VERSION:
+            raise RuntimeError('Unsupported SpeciesEstimator file version ' + str(version))
+        header = json.loads(file.read(header_length).decode("utf-8"))
+    data_offset = _align(PREAMBLE.size + header_length)
+    arrays = [np.memmap(path, dtype=np.dtype(dtype), mode="c", offset=data_offset + offset, shape=tuple(shape))
+              if np.prod(shape) > 0 else np.zeros(shape, dtype=np.dtype(dtype))
+              for dtype, shape, offset in header["arrays"]]
+
+    estimator = SpeciesEstimator(d0=header["include_d0"], d1=header["include_d1"], d2=header["include_d2"],
+                                 c0=header["include_c0"], c1=header["include_c1"], l_n=header["l_n"],
+                                 step_size=header["step_size"], n_jobs=header["n_jobs"], lazy=header["lazy"],
+                                 schedule=_restore_object(header["schedule"]), decay=header["decay"],
+                                 max_species=header.get("max_species"), deduplicate=header.get("deduplicate", False))
+    # shared objects are restored once, by position in the table of shared objects
+    restored = {}
+    for species_id, spec in header["species"].items():
+        if species_id in species_retrieval:
+            function = species_retrieval[species_id]
+        elif spec["retrieval"] is not None:
+            function = _restore_function(spec["retrieval"], header.get("shared", []), restored)
+        else:
+            raise RuntimeError('No species retrieval function given for species ' + species_id)
+        estimator.register(species_id, function)
+        if spec["schedule"] is not None:
+            estimator.schedules[species_id] = _restore_object(spec["schedule"])
+        _restore_manager(estimator.metrics[species_id], spec["manager"], arrays)
+    return estimator
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _manager_spec(manager: MetricManager, arrays: list) -> dict:
+    """
+    describes a metric manager by its scalar attributes, and appends its arrays to the list of arrays to be written
+    """
+    size = len(manager.vocabulary)
+    spec = {attribute: getattr(manager, attribute) for attribute in MANAGER_SCALARS}
+    if isinstance(manager, DecayedMetricManager):
+        spec.update({attribute: getattr(manager, attribute) for attribute in DECAYED_MANAGER_SCALARS})
+    if isinstance(manager, BoundedMetricManager):
+        spec.update({attribute: getattr(manager, attribute) for attribute in BOUNDED_MANAGER_SCALARS})
+        spec.update({attribute: list(getattr(manager, attribute).items()) for attribute in BOUNDED_FREQUENCY_COUNTS})
+        spec.update({attribute: [list(tail.items()) for tail in getattr(manager, attribute)]
+                     for attribute in BOUNDED_SEGMENT_FREQUENCY_COUNTS})
+        # the sketches, fingerprints and estimated counts of the demoted species of each segment
+        spec["sketches"] = []
+        for segment in zip(manager.abundance_sketches, manager.incidence_sketches, manager.demoted_fingerprints,
+                           manager.abundance_estimates, manager.incidence_estimates):
+            spec["sketches"].append(list(range(len(arrays), len(arrays) + len(segment))))
+            arrays.extend(segment)
+    spec["metric_names"] = manager.metric_names
+    spec["abundance_frequency_counts"] = list(manager.abundance_frequency_counts.items())
+    spec["incidence_frequency_counts"] = list(manager.incidence_frequency_counts.items())
+
+    # species are stored as a single JSON array, which is decoded in one pass
+    spec["vocabulary"] = len(arrays)
+    arrays.append(np.frombuffer(json.dumps(manager.vocabulary.species).encode("utf-8"), dtype=np.uint8))
+    spec["abundance_counts"] = len(arrays)
+    arrays.append(manager.abundance_counts[:size])
+    spec["incidence_counts"] = len(arrays)
+    arrays.append(manager.incidence_counts[:size])
+    spec["series"] = len(arrays)
+    arrays.append(manager.series[:manager.no_checkpoints])
+
+    if manager.lazy:
+        # the frequency counts of each checkpoint are stored as concatenated pairs, delimited by offsets
+        spec["snapshots"] = []
+        for model in range(2):
+            snapshots = [snapshot[model] if snapshot is not None else {} for snapshot in manager.snapshots]
+            offsets = np.cumsum([0] + [len(snapshot) for snapshot in snapshots])
+            pairs = np.array([pair for snapshot in snapshots for pair in snapshot.items()],
+                             dtype=np.int64).reshape(-1, 2)
+            spec["snapshots"].append([len(arrays), len(arrays) + 1])
+            arrays.append(offsets.astype(np.int64))
+            arrays.append(pairs)
+    return spec
+
+
+def _restore_manager(manager: MetricManager, spec: dict, arrays: list) -> None:
+    """
+    restores the state of a freshly registered metric manager from its description
+    """
+    if spec["metric_names"] != manager.metric_names:
+        raise RuntimeError('Stored metrics do not match the configuration of the estimator')
+    if isinstance(manager, DecayedMetricManager) and "checkpoint_times" not in spec:
+        # files written before checkpoint times were recorded only hold the decayed sample sizes
+        series = arrays[spec["series"]]
+        spec["checkpoint_times"] = series[:, manager.metric_columns["incidence_no_observations"]].astype(int).tolist()
+    for attribute in MANAGER_SCALARS + (DECAYED_MANAGER_SCALARS if isinstance(manager, DecayedMetricManager) else []):
+        setattr(manager, attribute, spec[attribute])
+    manager.abundance_frequency_counts = dict((k, f_k) for k, f_k in spec["abundance_frequency_counts"])
+    manager.incidence_frequency_counts = dict((k, f_k) for k, f_k in spec["incidence_frequency_counts"])
+    if isinstance(manager, BoundedMetricManager):
+        for attribute in BOUNDED_MANAGER_SCALARS:
+            setattr(manager, attribute, spec[attribute])
+        for attribute in BOUNDED_FREQUENCY_COUNTS:
+            setattr(manager, attribute, dict((k, f_k) for k, f_k in spec[attribute]))
+        for attribute in BOUNDED_SEGMENT_FREQUENCY_COUNTS:
+            setattr(manager, attribute, [dict((k, f_k) for k, f_k in tail) for tail in spec[attribute]])
+        if any(not isinstance(segment, list) or len(segment) < 5 for segment in spec["sketches"]):
+            raise RuntimeError('Cannot load bounded reference samples without fingerprints of the demoted species')
+        manager.abundance_sketches = [arrays[segment[0]] for segment in spec["sketches"]]
+        manager.incidence_sketches = [arrays[segment[1]] for segment in spec["sketches"]]
+        manager.demoted_fingerprints = [arrays[segment[2]] for segment in spec["sketches"]]
+        manager.abundance_estimates = [arrays[segment[3]] for segment in spec["sketches"]]
+        manager.incidence_estimates = [arrays[segment[4]] for segment in spec["sketches"]]
+
+    manager.vocabulary = SpeciesVocabulary()
+    species = json.loads(arrays[spec["vocabulary"]].tobytes().decode("utf-8"))
+    manager.vocabulary.intern_all([tuple(s) if isinstance(s, list) else s for s in species])
+    manager.abundance_counts = arrays[spec["abundance_counts"]]
+    manager.incidence_counts = arrays[spec["incidence_counts"]]
+    manager.series = arrays[spec["series"]]
+
+    if manager.lazy:
+        models = []
+        for offsets_index, pairs_index in spec["snapshots"]:
+            offsets = arrays[offsets_index].tolist()
+            pairs = arrays[pairs_index].tolist()
+            models.append([dict(pairs[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)])
+        manager.snapshots = [None] + list(zip(models[0][1:], models[1][1:]))
+
+
+def _function_spec(function: Callable, shared: dict | None = None) -> dict | None:
+    """
+    describes a species retrieval function by its importable name and, for partials, its bound arguments. Callable
+    objects are described by their class and attributes. Returns None for functions that cannot be imported by name
+    """
+    if not isinstance(function, (FunctionType, BuiltinFunctionType, partial, type)):
+        spec = _object_spec(function, shared)
+        if spec is not None:
+            spec["object"] = True
+        return spec
+    if isinstance(function, partial):
+        spec = _function_spec(function.func)
+        if spec is not None:
+            spec["args"] = list(function.args)
+            spec["keywords"] = function.keywords
+        return spec
+    module = getattr(function, "__module__", None)
+    qualname = getattr(function, "__qualname__", None)
+    if module is None or qualname is None or "<" in qualname:
+        return None
+    return {"module": module, "qualname": qualname}
+
+
+def _restore_function(spec: dict, shared: list | None = None, restored: dict | None = None) -> Callable:
+    if spec.get("object", False):
+        return _restore_object(spec, shared, restored)
+    function = importlib.import_module(spec["module"])
+    for name in spec["qualname"].split("."):
+        function = getattr(function, name)
+    if "args" in spec:
+        function = partial(function, *spec["args"], **spec["keywords"])
+    return function
+
+
+def _object_spec(instance, shared: dict | None = None) -> dict | None:
+    """
+    describes a schedule or callable object by its class and attributes, remembering which attributes are tuples as
+    JSON only knows lists. Attributes holding objects are described recursively, or by reference to the table of
+    shared objects if given, so that objects referenced by several functions are shared again when restored. Private
+    attributes, e.g. caches, are omitted
+    """
+    if instance is None:
+        return None
+    spec = _function_spec(type(instance))
+    if spec is None:
+        return None
+    attributes = {name: value for name, value in vars(instance).items() if not name.startswith("_")}
+    spec["tuples"] = [name for name, value in attributes.items() if isinstance(value, tuple)]
+    spec["objects"] = [name for name, value in attributes.items()
+                       if not isinstance(value, (str, int, float, bool, list, tuple, dict, type(None)))]
+    for name in spec["objects"]:
+        attributes[name] = _object_spec(attributes[name]) if shared is None else _shared_spec(attributes[name], shared)
+    spec["attributes"] = attributes
+    return spec
+
+
+def _shared_spec(instance, shared: dict) -> dict:
+    """
+    describes an object by its position in the table of shared objects, adding it to the table on first sight
+    """
+    if id(instance) not in shared:
+        # the position is taken before the object is described, as its attributes may add further objects
+        shared[id(instance)] = None
+        shared[id(instance)] = _object_spec(instance, shared)
+    return {"shared": list(shared).index(id(instance))}
+
+
+def _restore_object(spec: dict | None, shared: list | None = None, restored: dict | None = None):
+    if spec is None:
+        return None
+    instance = object.__new__(_restore_function({"module": spec["module"], "qualname": spec["qualname"]}))
+    # files written before tuples were recorded only hold schedules, whose lists were all tuples
+    tuples = spec.get("tuples", [name for name, value in spec["attributes"].items() if isinstance(value, list)])
+    objects = spec.get("objects", [])
+    instance.__dict__.update({name: tuple(value) if name in tuples else
+                              _restore_shared(value, shared, restored) if name in objects else value
+                              for name, value in spec["attributes"].items()})
+    return instance
+
+
+def _restore_shared(spec: dict | None, shared: list | None, restored: dict | None):
+    """
+    restores an object described by _object_spec or by reference to the table of shared objects, restoring each
+    shared object only once
+    """
+    if spec is None or "shared" not in spec:
+        return _restore_object(spec, shared, restored)
+    index = spec["shared"]
+    if index not in restored:
+        restored[index] = _restore_object(shared[index], shared, restored)
+    return restored[index]
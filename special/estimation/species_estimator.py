@@ -1,14 +1,47 @@
+import copy
+import hashlib
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import Mapping
 from enum import Enum
-from typing import Callable, List, Dict, Any
+from typing import Callable, List, Dict, Any, Iterable
 
+import numpy as np
 import pandas as pd
 import pm4py
 from pandas import DataFrame
 from pm4py.objects.log.obj import EventLog, Trace
 from tqdm import tqdm
 
-from special.estimation.metrics import get_singletons, get_doubletons, completeness, coverage, \
-    sampling_effort_abundance, sampling_effort_incidence, hill_number_asymptotic, entropy_exp, simpson_diversity
+from special.estimation.checkpoint_schedule import CheckpointSchedule
+from special.estimation.instrumentation import NullTimer, PhaseTimer
+from special.estimation.species_vocabulary import SpeciesVocabulary
+from special.estimation.species_retrieval import is_activity_based, is_batch_based, get_activity_sequences, \
+    get_activities
+from special.estimation.metrics import get_frequency_counts, get_number_observed_species, get_singletons, \
+    get_doubletons, completeness, coverage, sampling_effort_abundance, sampling_effort_incidence, \
+    hill_number_asymptotic, entropy_exp_from_sums, simpson_diversity_from_sums, frequency_count_matrix, \
+    batch_metrics, estimate_species_richness_chao
+
+# initial number of species the count arrays of a MetricManager can hold before they are grown
+INITIAL_CAPACITY = 64
+# initial number of checkpoints the metric series of a MetricManager can hold before they are grown
+INITIAL_CHECKPOINTS = 64
+# exponent of the factor by which decayed weights may grow before they are rescaled
+RESCALE_EXPONENT = 50
+# species observed in at most this many observations are always counted exactly in bounded mode, as the estimators
+# depend on the exact number of singletons and doubletons
+EXACT_FREQUENCIES = 2
+# number of rows of the count-min sketches holding the counts of demoted species in bounded mode
+SKETCH_DEPTH = 4
+# number of bisection steps when lowering the estimated counts of demoted species to their true total
+FILL_LEVEL_ITERATIONS = 64
+# metrics that are recorded at every checkpoint, even if the remaining metrics are computed lazily
+SAMPLE_STATISTICS = ["abundance_no_observations", "incidence_no_observations", "abundance_sum_species_counts",
+                     "incidence_sum_species_counts", "degree_of_aggregation", "abundance_singletons",
+                     "incidence_singletons", "abundance_doubletons", "incidence_doubletons"]
+
 
 class metric_names(Enum):
     NO_OBSERVATIONS_ABUNDANCE = "abundance_no_observations"
@@ -16,17 +49,32 @@ class metric_names(Enum):
     # TODO finalize
 
 
-class MetricManager(dict):
+class MetricManager(Mapping):
     # TODO convert to dataclass
     """
-    Manages metrics for abundance and incidence models.
+    Manages metrics for abundance and incidence models. The series of each metric is stored as a column of a single
+    float matrix holding one row per checkpoint, and is exposed read-only via item access, e.g.
+    manager["abundance_c0"]. In lazy mode, only the sample statistics and a snapshot of the frequency counts are
+    recorded at each checkpoint, and all other series are computed from these snapshots on first access
     """
 
-    def __init__(self, d0: bool, d1: bool, d2: bool, c0: bool, c1: bool, l_n: list) -> None:
+    def __init__(self, d0: bool, d1: bool, d2: bool, c0: bool, c1: bool, l_n: list, lazy: bool = False) -> None:
         # reference sample stats
-        super().__init__()
-        self.reference_sample_abundance = {}
-        self.reference_sample_incidence = {}
+        # species are interned to dense ids, their counts are kept in arrays indexed by these ids
+        self.vocabulary = SpeciesVocabulary()
+        self.abundance_counts = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.incidence_counts = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+
+        # frequency counts f_k, i.e. the number of species observed exactly k times, kept in sync with the
+        # reference samples so that metrics do not need to scan all species
+        self.abundance_frequency_counts = {}
+        self.incidence_frequency_counts = {}
+        # running sums of x*log(x) and x^2 over the species counts x, kept in sync with the reference samples so that
+        # sample-based D1 and D2 can be read without scanning the species
+        self.abundance_sum_x_log_x = 0.0
+        self.incidence_sum_x_log_x = 0.0
+        self.abundance_sum_squares = 0
+        self.incidence_sum_squares = 0
 
         self.incidence_current_total_species_count = 0
         self.abundance_current_total_species_count = 0
@@ -34,45 +82,922 @@ class MetricManager(dict):
         self.abundance_sample_size = 0
         self.current_spatial_aggregation = 0
 
-        self["abundance_no_observations"] = [0]
-        self["incidence_no_observations"] = [0]
-        self["abundance_sum_species_counts"] = [0]
-        self["incidence_sum_species_counts"] = [0]
-        self["degree_of_aggregation"] = [0]
-        self["abundance_singletons"] = [0]
-        self["incidence_singletons"] = [0]
-        self["abundance_doubletons"] = [0]
-        self["incidence_doubletons"] = [0]
+        metric_names = list(SAMPLE_STATISTICS)
 
         if d0:
-            self["abundance_sample_d0"] = [0]
-            self["incidence_sample_d0"] = [0]
-            self["abundance_estimate_d0"] = [0]
-            self["incidence_estimate_d0"] = [0]
+            metric_names += ["abundance_sample_d0", "incidence_sample_d0", "abundance_estimate_d0",
+                             "incidence_estimate_d0"]
 
         if d1:
-            self["abundance_sample_d1"] = [0]
-            self["incidence_sample_d1"] = [0]
-            self["abundance_estimate_d1"] = [0]
-            self["incidence_estimate_d1"] = [0]
+            metric_names += ["abundance_sample_d1", "incidence_sample_d1", "abundance_estimate_d1",
+                             "incidence_estimate_d1"]
 
         if d2:
-            self["abundance_sample_d2"] = [0]
-            self["incidence_sample_d2"] = [0]
-            self["abundance_estimate_d2"] = [0]
-            self["incidence_estimate_d2"] = [0]
+            metric_names += ["abundance_sample_d2", "incidence_sample_d2", "abundance_estimate_d2",
+                             "incidence_estimate_d2"]
 
         if c0:
-            self["abundance_c0"] = [0]
-            self["incidence_c0"] = [0]
+            metric_names += ["abundance_c0", "incidence_c0"]
 
         if c1:
-            self["abundance_c1"] = [0]
-            self["incidence_c1"] = [0]
+            metric_names += ["abundance_c1", "incidence_c1"]
 
         for l in l_n:
-            self["abundance_l_" + str(l)] = [0]
-            self["incidence_l_" + str(l)] = [0]
+            metric_names += ["abundance_l_" + str(l), "incidence_l_" + str(l)]
+
+        self.metric_names = metric_names
+        self.metric_columns = {name: i for i, name in enumerate(metric_names)}
+        # each series starts with an initial checkpoint of value 0
+        self.series = np.zeros((INITIAL_CHECKPOINTS, len(metric_names)))
+        self.no_checkpoints = 1
+
+        self.lazy = lazy
+        # frequency counts of the abundance and incidence reference samples at each checkpoint, used in lazy mode
+        self.snapshots = [None]
+        # number of checkpoints for which each lazily computed metric has been evaluated so far
+        self.evaluated_checkpoints = {name: 1 for name in metric_names if name not in SAMPLE_STATISTICS}
+        # flag indicating if the latest checkpoint was recorded at the end of the data rather than by the schedule
+        self.closing_checkpoint = False
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if self.lazy:
+            self.evaluate(name)
+        view = self.series[:self.no_checkpoints, self.metric_columns[name]]
+        view.flags.writeable = False
+        return view
+
+    def __iter__(self):
+        return iter(self.metric_names)
+
+    def __len__(self) -> int:
+        return len(self.metric_names)
+
+    def new_checkpoint(self) -> None:
+        """
+        starts a new checkpoint, growing the metric series geometrically if needed. The values of the checkpoint are
+        set using record
+        """
+        if self.no_checkpoints == len(self.series):
+            series = np.zeros((2 * len(self.series), len(self.metric_names)))
+            series[:self.no_checkpoints] = self.series
+            self.series = series
+        self.no_checkpoints = self.no_checkpoints + 1
+        self.closing_checkpoint = False
+
+    def remove_checkpoint(self) -> None:
+        """
+        removes the latest checkpoint from the metric series
+        """
+        self.no_checkpoints = self.no_checkpoints - 1
+        if self.lazy:
+            self.snapshots.pop()
+        for name in self.evaluated_checkpoints:
+            self.evaluated_checkpoints[name] = min(self.evaluated_checkpoints[name], self.no_checkpoints)
+        self.closing_checkpoint = False
+
+    def record(self, name: str, value: float) -> None:
+        """
+        sets the value of a metric at the current checkpoint
+        :param name: the name of the metric
+        :param value: the value of the metric
+        """
+        self.series[self.no_checkpoints - 1, self.metric_columns[name]] = value
+
+    def record_snapshot(self) -> None:
+        """
+        stores the current frequency counts for the current checkpoint, from which the remaining metrics can be
+        computed later on
+        """
+        self.snapshots.append((dict(self.abundance_frequency_counts), dict(self.incidence_frequency_counts)))
+
+    def evaluate(self, name: str) -> None:
+        """
+        computes a lazily evaluated metric for all checkpoints it has not been computed for yet. All pending metrics
+        of the same data type are computed alongside in one batch
+        :param name: the name of the metric
+        """
+        if name not in self.evaluated_checkpoints or self.evaluated_checkpoints[name] == self.no_checkpoints:
+            return
+        prefix = name.split("_", 1)[0] + "_"
+        names = [n for n in self.evaluated_checkpoints if n.startswith(prefix)]
+        first = min(self.evaluated_checkpoints[n] for n in names)
+        abundance = prefix == "abundance_"
+        k, frequency_counts = frequency_count_matrix(
+            [snapshot[0 if abundance else 1] for snapshot in self.snapshots[first:self.no_checkpoints]])
+        sample_sizes = self.series[first:self.no_checkpoints, self.metric_columns[prefix + "no_observations"]]
+        values = batch_metrics([n[len(prefix):] for n in names], k, frequency_counts, sample_sizes, abundance)
+        for n in names:
+            column = self.metric_columns[n]
+            evaluated = self.evaluated_checkpoints[n]
+            self.series[evaluated:self.no_checkpoints, column] = values[n[len(prefix):]][evaluated - first:]
+            self.evaluated_checkpoints[n] = self.no_checkpoints
+
+    def series_view(self) -> np.ndarray:
+        """
+        returns a read-only view on the metric series, with one row per checkpoint and one column per metric, ordered
+        as in metric_names
+        :return: the metric series
+        """
+        if self.lazy:
+            for name in self.evaluated_checkpoints:
+                self.evaluate(name)
+        view = self.series[:self.no_checkpoints]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def no_observations(self) -> int:
+        """
+        the number of observations added so far, to which the step size of profile updates refers
+        """
+        return self.incidence_sample_size
+
+    @property
+    def last_checkpoint_observations(self) -> int:
+        """
+        the number of observations at the latest checkpoint, counted as in no_observations
+        """
+        return int(self.series[self.no_checkpoints - 1, self.metric_columns["incidence_no_observations"]])
+
+    @property
+    def reference_sample_abundance(self) -> dict:
+        """
+        the abundance-based reference sample, i.e. the observed species with their abundance counts
+        """
+        return self.vocabulary.to_dict(self.abundance_counts)
+
+    @property
+    def reference_sample_incidence(self) -> dict:
+        """
+        the incidence-based reference sample, i.e. the observed species with their incidence counts
+        """
+        return self.vocabulary.to_dict(self.incidence_counts)
+
+    def current_counts(self, model: str) -> np.ndarray:
+        """
+        returns the counts of all species of a reference sample, indexed by species id
+        :param model: "abundance" or "incidence"
+        :return: the species counts
+        """
+        return getattr(self, model + "_counts")[:len(self.vocabulary)]
+
+    def current_sample(self, model: str) -> tuple:
+        """
+        returns the size and the frequency counts of a reference sample, including the observations added since the
+        latest checkpoint, e.g. for schedules deciding whether a checkpoint is due
+        :param model: "abundance" or "incidence"
+        :return: the sample size and the frequency counts f_k
+        """
+        return getattr(self, model + "_sample_size"), getattr(self, model + "_frequency_counts")
+
+    def add_species(self, species_abundance: list) -> None:
+        """
+        adds the species retrieved from a single observation to the reference samples
+        :param species_abundance: the species retrieved from the observation, including repetitions
+        """
+        species_ids = self.vocabulary.intern_all(species_abundance)
+        self.ensure_capacity(len(self.vocabulary))
+        x_log_x, squares = MetricManager.add_counts(self.abundance_counts, self.abundance_frequency_counts,
+                                                    species_ids)
+        self.abundance_sum_x_log_x = self.abundance_sum_x_log_x + x_log_x
+        self.abundance_sum_squares = self.abundance_sum_squares + squares
+        # each distinct species of the observation adds 1 to its incidence count
+        x_log_x, squares = MetricManager.add_counts(self.incidence_counts, self.incidence_frequency_counts,
+                                                    set(species_ids))
+        self.incidence_sum_x_log_x = self.incidence_sum_x_log_x + x_log_x
+        self.incidence_sum_squares = self.incidence_sum_squares + squares
+
+    def add_weighted_species(self, species_abundance: list, multiplicity: int) -> None:
+        """
+        adds the species retrieved from an observation to the reference samples as if the observation had been made
+        multiplicity times
+        :param species_abundance: the species retrieved from the observation, including repetitions
+        :param multiplicity: the number of times the observation was made
+        """
+        species_ids = self.vocabulary.intern_all(species_abundance)
+        self.ensure_capacity(len(self.vocabulary))
+        increments = {}
+        for i in species_ids:
+            increments[i] = increments.get(i, 0) + multiplicity
+        x_log_x, squares = MetricManager.add_weighted_counts(self.abundance_counts, self.abundance_frequency_counts,
+                                                             increments)
+        self.abundance_sum_x_log_x = self.abundance_sum_x_log_x + x_log_x
+        self.abundance_sum_squares = self.abundance_sum_squares + squares
+        x_log_x, squares = MetricManager.add_weighted_counts(self.incidence_counts, self.incidence_frequency_counts,
+                                                             dict.fromkeys(increments, multiplicity))
+        self.incidence_sum_x_log_x = self.incidence_sum_x_log_x + x_log_x
+        self.incidence_sum_squares = self.incidence_sum_squares + squares
+
+    def remove_species(self, species_abundance: list) -> None:
+        """
+        removes the species retrieved from a single, previously added observation from the reference samples
+        :param species_abundance: the species retrieved from the observation, including repetitions
+        """
+        species_ids = [self.vocabulary.ids[s] for s in species_abundance]
+        x_log_x, squares = MetricManager.remove_counts(self.abundance_counts, self.abundance_frequency_counts,
+                                                       species_ids)
+        self.abundance_sum_x_log_x = self.abundance_sum_x_log_x + x_log_x
+        self.abundance_sum_squares = self.abundance_sum_squares + squares
+        x_log_x, squares = MetricManager.remove_counts(self.incidence_counts, self.incidence_frequency_counts,
+                                                       set(species_ids))
+        self.incidence_sum_x_log_x = self.incidence_sum_x_log_x + x_log_x
+        self.incidence_sum_squares = self.incidence_sum_squares + squares
+        # species are only pruned once they make up half of the vocabulary, which amortises rebuilding it
+        if len(self.vocabulary) > max(2 * sum(self.abundance_frequency_counts.values()), INITIAL_CAPACITY):
+            self.prune_unobserved()
+
+    def prune_unobserved(self) -> None:
+        """
+        removes species whose counts dropped to zero, e.g. as their observations left a window, from the vocabulary
+        and the count arrays
+        """
+        size = len(self.vocabulary)
+        # the incidence count of a species never exceeds its abundance count
+        keep = np.flatnonzero(self.abundance_counts[:size])
+        vocabulary = SpeciesVocabulary()
+        vocabulary.intern_all([self.vocabulary.species[i] for i in keep.tolist()])
+        self.vocabulary = vocabulary
+        for name in ("abundance_counts", "incidence_counts"):
+            counts = np.zeros(max(len(keep), INITIAL_CAPACITY), dtype=np.int64)
+            counts[:len(keep)] = getattr(self, name)[keep]
+            setattr(self, name, counts)
+
+    def ensure_capacity(self, size: int) -> None:
+        """
+        grows the count arrays geometrically, such that they can hold counts for at least the given number of species
+        :param size: the required number of species
+        """
+        if size <= len(self.abundance_counts):
+            return
+        capacity = max(size, 2 * len(self.abundance_counts))
+        for name in ("abundance_counts", "incidence_counts"):
+            counts = np.zeros(capacity, dtype=getattr(self, name).dtype)
+            counts[:len(getattr(self, name))] = getattr(self, name)
+            setattr(self, name, counts)
+
+    @staticmethod
+    def add_counts(counts: np.ndarray, frequency_counts: dict, species_ids) -> tuple:
+        """
+        increments the count of each given species by one and moves the species to its next frequency class
+        :param counts: the species counts, indexed by species id
+        :param frequency_counts: the frequency counts f_k belonging to the species counts
+        :param species_ids: the ids of the observed species
+        :return: the resulting changes of the sums of x*log(x) and x^2 over all species counts x
+        """
+        x_log_x = 0.0
+        squares = 0
+        log = math.log
+        # element access through a memoryview yields plain ints instead of creating a NumPy scalar per species
+        view = memoryview(counts)
+        for i in species_ids:
+            k = view[i]
+            view[i] = k + 1
+            squares = squares + 2 * k + 1
+            if k > 0:
+                x_log_x = x_log_x + (k + 1) * log(k + 1) - k * log(k)
+                if frequency_counts[k] == 1:
+                    del frequency_counts[k]
+                else:
+                    frequency_counts[k] = frequency_counts[k] - 1
+            frequency_counts[k + 1] = frequency_counts.get(k + 1, 0) + 1
+        return x_log_x, squares
+
+    @staticmethod
+    def add_weighted_counts(counts: np.ndarray, frequency_counts: dict, increments: dict) -> tuple:
+        """
+        increments the counts of the given species and moves each of them to its new frequency class
+        :param counts: the species counts, indexed by species id
+        :param frequency_counts: the frequency counts f_k belonging to the species counts
+        :param increments: the positive increment of the count of each species, by species id
+        :return: the resulting changes of the sums of x*log(x) and x^2 over all species counts x
+        """
+        x_log_x = 0.0
+        squares = 0
+        log = math.log
+        view = memoryview(counts)
+        for i, w in increments.items():
+            k = view[i]
+            view[i] = k + w
+            squares = squares + (2 * k + w) * w
+            x_log_x = x_log_x + (k + w) * log(k + w)
+            if k > 0:
+                x_log_x = x_log_x - k * log(k)
+                if frequency_counts[k] == 1:
+                    del frequency_counts[k]
+                else:
+                    frequency_counts[k] = frequency_counts[k] - 1
+            frequency_counts[k + w] = frequency_counts.get(k + w, 0) + 1
+        return x_log_x, squares
+
+    @staticmethod
+    def remove_counts(counts: np.ndarray, frequency_counts: dict, species_ids) -> tuple:
+        """
+        decrements the count of each given species by one and moves the species to its previous frequency class
+        :param counts: the species counts, indexed by species id
+        :param frequency_counts: the frequency counts f_k belonging to the species counts
+        :param species_ids: the ids of the removed species, each of which must have a positive count
+        :return: the resulting changes of the sums of x*log(x) and x^2 over all species counts x
+        """
+        x_log_x = 0.0
+        squares = 0
+        log = math.log
+        view = memoryview(counts)
+        for i in species_ids:
+            k = view[i]
+            view[i] = k - 1
+            squares = squares - 2 * k + 1
+            if frequency_counts[k] == 1:
+                del frequency_counts[k]
+            else:
+                frequency_counts[k] = frequency_counts[k] - 1
+            if k > 1:
+                x_log_x = x_log_x + (k - 1) * log(k - 1) - k * log(k)
+                frequency_counts[k - 1] = frequency_counts.get(k - 1, 0) + 1
+        return x_log_x, squares
+
+    @staticmethod
+    def sums(frequency_counts: dict) -> tuple:
+        """
+        computes the sums of x*log(x) and x^2 over all species counts x from scratch
+        :param frequency_counts: the frequency counts f_k of the species counts
+        :return: the sum of x*log(x) and the sum of x^2
+        """
+        return (sum(f_k * k * math.log(k) for k, f_k in frequency_counts.items()),
+                sum(f_k * k ** 2 for k, f_k in frequency_counts.items()))
+
+    def reset_profiles(self) -> None:
+        """
+        resets all diversity and completeness profiles to their initial value, keeping the reference samples
+        """
+        self.series = np.zeros((INITIAL_CHECKPOINTS, len(self.metric_names)))
+        self.no_checkpoints = 1
+        self.snapshots = [None]
+        self.evaluated_checkpoints = {name: 1 for name in self.evaluated_checkpoints}
+        self.closing_checkpoint = False
+
+    def merge(self, other: "MetricManager") -> "MetricManager":
+        """
+        merges the reference samples of two managers, e.g. obtained from different shards of an event log, into a new
+        manager. Merging is associative and commutative. As the checkpoints of both managers refer to different
+        samples, the profiles of the merged manager are reset and have to be recomputed from the merged counts
+        :param other: the manager to merge with
+        :return: a new manager containing the combined reference samples
+        """
+        if self.keys() != other.keys():
+            raise RuntimeError('Cannot merge metric managers tracking different metrics')
+        merged = copy.copy(self)
+        merged.reset_profiles()
+
+        # species ids of the other manager are translated to ids of the merged vocabulary
+        merged.vocabulary = copy.deepcopy(self.vocabulary)
+        other_ids = np.asarray(merged.vocabulary.intern_all(other.vocabulary.species), dtype=np.int64)
+        size = len(merged.vocabulary)
+        merged.abundance_counts = MetricManager.merge_counts(self.abundance_counts, other.abundance_counts,
+                                                             other_ids, size)
+        merged.incidence_counts = MetricManager.merge_counts(self.incidence_counts, other.incidence_counts,
+                                                             other_ids, size)
+        # frequency classes of the merged species are not known from the frequency counts of both managers
+        merged.abundance_frequency_counts = get_frequency_counts(merged.abundance_counts)
+        merged.incidence_frequency_counts = get_frequency_counts(merged.incidence_counts)
+        merged.abundance_sum_x_log_x, merged.abundance_sum_squares = MetricManager.sums(
+            merged.abundance_frequency_counts)
+        merged.incidence_sum_x_log_x, merged.incidence_sum_squares = MetricManager.sums(
+            merged.incidence_frequency_counts)
+
+        merged.abundance_sample_size = self.abundance_sample_size + other.abundance_sample_size
+        merged.incidence_sample_size = self.incidence_sample_size + other.incidence_sample_size
+        merged.abundance_current_total_species_count = \
+            self.abundance_current_total_species_count + other.abundance_current_total_species_count
+        merged.incidence_current_total_species_count = \
+            self.incidence_current_total_species_count + other.incidence_current_total_species_count
+        merged.current_spatial_aggregation = 0
+        if merged.abundance_current_total_species_count > 0:
+            merged.current_spatial_aggregation = 1 - (merged.incidence_current_total_species_count /
+                                                      merged.abundance_current_total_species_count)
+        return merged
+
+    @staticmethod
+    def merge_counts(counts: np.ndarray, other_counts: np.ndarray, other_ids: np.ndarray, size: int) -> np.ndarray:
+        """
+        adds up the species counts of two reference samples
+        :param counts: the species counts, indexed by species id of the merged vocabulary
+        :param other_counts: the species counts to be added, indexed by species id of their own vocabulary
+        :param other_ids: the ids in the merged vocabulary of the species of the counts to be added
+        :param size: the number of species in the merged vocabulary
+        :return: a new array containing the summed up counts
+        """
+        merged = np.zeros(max(size, len(counts)), dtype=np.int64)
+        merged[:len(counts)] = counts
+        merged[other_ids] += other_counts[:len(other_ids)]
+        return merged
+
+
+class DecayedMetricManager(MetricManager):
+    """
+    Manages metrics for exponentially time-decayed reference samples, in which the species of each observation are
+    weighted by exp(-decay * age), where age is the number of observations added since. Weights are stored relative to
+    a reference time, so that adding an observation only touches its own species. Only once the stored weights grow
+    too large, all of them are rescaled to the current time and species of negligible weight are pruned. At each
+    checkpoint, the decayed weights are rounded to counts, from which sample sizes, frequency counts and metrics are
+    derived
+    """
+
+    def __init__(self, d0: bool, d1: bool, d2: bool, c0: bool, c1: bool, l_n: list, lazy: bool = False,
+                 decay: float = 0.001, prune_below: float = 0.01) -> None:
+        """
+        :param decay: the decay rate per observation
+        :param prune_below: the weight below which species are removed from the reference samples when rescaling
+        """
+        super().__init__(d0, d1, d2, c0, c1, l_n, lazy)
+        self.decay = decay
+        self.prune_below = prune_below
+        self.abundance_counts = np.zeros(INITIAL_CAPACITY)
+        self.incidence_counts = np.zeros(INITIAL_CAPACITY)
+        self.time = 0
+        self.reference_time = 0
+        # the decayed number of observations, relative to the reference time
+        self.observation_weight = 0.0
+        # the number of added observations at each checkpoint, as the recorded sample sizes are decayed
+        self.checkpoint_times = [0]
+
+    @property
+    def no_observations(self) -> int:
+        return self.time
+
+    @property
+    def last_checkpoint_observations(self) -> int:
+        return self.checkpoint_times[self.no_checkpoints - 1]
+
+    @property
+    def reference_sample_abundance(self) -> dict:
+        return self.vocabulary.to_dict(self.abundance_counts * self.current_factor())
+
+    @property
+    def reference_sample_incidence(self) -> dict:
+        return self.vocabulary.to_dict(self.incidence_counts * self.current_factor())
+
+    def current_factor(self) -> float:
+        """
+        returns the factor by which stored weights are multiplied to obtain the decayed weights at the current time
+        """
+        return math.exp(-self.decay * (self.time - self.reference_time))
+
+    def current_counts(self, model: str) -> np.ndarray:
+        """
+        returns the decayed weights of all species of a reference sample at the current time, indexed by species id
+        :param model: "abundance" or "incidence"
+        :return: the species weights
+        """
+        return getattr(self, model + "_counts")[:len(self.vocabulary)] * self.current_factor()
+
+    def current_sample(self, model: str) -> tuple:
+        # the decayed weights are rounded to counts, as at each checkpoint
+        counts = np.rint(self.current_counts(model)).astype(np.int64)
+        if model == "abundance":
+            return int(counts.sum()), get_frequency_counts(counts)
+        return round(self.observation_weight * self.current_factor()), get_frequency_counts(counts)
+
+    def add_species(self, species_abundance: list) -> None:
+        self.time = self.time + 1
+        if self.decay * (self.time - self.reference_time) > RESCALE_EXPONENT:
+            self.rescale()
+        species_ids = self.vocabulary.intern_all(species_abundance)
+        self.ensure_capacity(len(self.vocabulary))
+        weight = 1 / self.current_factor()
+        abundance_counts = memoryview(self.abundance_counts)
+        for i in species_ids:
+            abundance_counts[i] = abundance_counts[i] + weight
+        incidence_counts = memoryview(self.incidence_counts)
+        for i in set(species_ids):
+            incidence_counts[i] = incidence_counts[i] + weight
+        self.observation_weight = self.observation_weight + weight
+
+    def rescale(self) -> None:
+        """
+        rescales all stored weights to the current time and prunes species whose weight fell below prune_below,
+        including their entries in the vocabulary
+        """
+        factor = self.current_factor()
+        size = len(self.vocabulary)
+        self.abundance_counts[:size] = self.abundance_counts[:size] * factor
+        self.incidence_counts[:size] = self.incidence_counts[:size] * factor
+        self.observation_weight = self.observation_weight * factor
+        self.reference_time = self.time
+
+        # the incidence weight of a species never exceeds its abundance weight
+        keep = np.flatnonzero(self.abundance_counts[:size] >= self.prune_below)
+        if len(keep) == size:
+            return
+        vocabulary = SpeciesVocabulary()
+        vocabulary.intern_all([self.vocabulary.species[i] for i in keep.tolist()])
+        self.vocabulary = vocabulary
+        for name in ("abundance_counts", "incidence_counts"):
+            counts = np.zeros(max(len(keep), INITIAL_CAPACITY))
+            counts[:len(keep)] = getattr(self, name)[keep]
+            setattr(self, name, counts)
+
+    def new_checkpoint(self) -> None:
+        """
+        starts a new checkpoint, deriving the reference samples the metrics are computed from by rounding the decayed
+        weights to counts
+        """
+        abundance_counts = np.rint(self.current_counts("abundance")).astype(np.int64)
+        incidence_counts = np.rint(self.current_counts("incidence")).astype(np.int64)
+
+        self.abundance_frequency_counts = get_frequency_counts(abundance_counts)
+        self.incidence_frequency_counts = get_frequency_counts(incidence_counts)
+        self.abundance_sum_x_log_x, self.abundance_sum_squares = MetricManager.sums(self.abundance_frequency_counts)
+        self.incidence_sum_x_log_x, self.incidence_sum_squares = MetricManager.sums(self.incidence_frequency_counts)
+
+        self.abundance_current_total_species_count = int(abundance_counts.sum())
+        self.incidence_current_total_species_count = int(incidence_counts.sum())
+        self.abundance_sample_size = self.abundance_current_total_species_count
+        self.incidence_sample_size = round(self.observation_weight * self.current_factor())
+        self.current_spatial_aggregation = 0
+        if self.abundance_current_total_species_count > 0:
+            self.current_spatial_aggregation = 1 - (self.incidence_current_total_species_count /
+                                                    self.abundance_current_total_species_count)
+        super().new_checkpoint()
+        self.checkpoint_times[self.no_checkpoints - 1:] = [self.time]
+
+    def add_weighted_species(self, species_abundance: list, multiplicity: int) -> None:
+        raise RuntimeError('Cannot add weighted species to decayed reference samples')
+
+    def remove_species(self, species_abundance: list) -> None:
+        raise RuntimeError('Cannot remove species from decayed reference samples')
+
+    def merge(self, other: "MetricManager") -> "MetricManager":
+        raise RuntimeError('Cannot merge decayed reference samples')
+
+
+class BoundedMetricManager(MetricManager):
+    """
+    Manages metrics for reference samples with a bounded number of exactly counted species. Once more than
+    max_species species are held, the most frequent ones are demoted to count-min sketches until half of the budget
+    is free. Further observations of demoted species only update the sketches, whose estimates exceed the true counts
+    by at most e/width times the total count of their sketch with probability 1 - exp(-depth). Demoted species are
+    remembered by a 64-bit fingerprint along with their latest estimated counts, so that species observed for the
+    first time are always counted exactly, and the frequency classes of demoted species follow their estimates.
+    Sketches are added in segments of doubling width as more species are demoted, such that each segment holds at
+    most as many species as it has counters per row, and memory grows with the number of demoted species rather than
+    with the number of observations. Species observed in at most EXACT_FREQUENCIES observations are never demoted, so
+    that singletons and doubletons, and with them the richness, coverage and sampling effort estimators, stay exact.
+    Frequency counts of demoted species are kept separately for each segment, in the frequency classes of their
+    estimated counts, and are combined with the exact ones at each checkpoint
+    """
+
+    def __init__(self, d0: bool, d1: bool, d2: bool, c0: bool, c1: bool, l_n: list, lazy: bool = False,
+                 max_species: int = 1000000, sketch_width: int | None = None) -> None:
+        """
+        :param max_species: the number of species counted exactly before the most frequent ones are demoted. May be
+        exceeded if more species are observed in at most EXACT_FREQUENCIES observations
+        :param sketch_width: the number of counters per row of the first segment of the sketches. Defaults to the
+        smallest power of two not below max_species
+        """
+        super().__init__(d0, d1, d2, c0, c1, l_n, lazy)
+        self.max_species = max_species
+        self.compaction_limit = max_species
+        self.sketch_width = sketch_width or 1 << max(max_species - 1, 1).bit_length()
+        # one flattened sketch per model and a sorted array of the fingerprints of its demoted species per segment,
+        # along with the estimated counts of each demoted species at its latest observation
+        self.abundance_sketches = []
+        self.incidence_sketches = []
+        self.demoted_fingerprints = []
+        self.abundance_estimates = []
+        self.incidence_estimates = []
+        self.no_demoted = 0
+
+        # frequency counts of exactly counted species, and of demoted species per segment, combined at each checkpoint
+        self.exact_abundance_frequency_counts = {}
+        self.exact_incidence_frequency_counts = {}
+        self.tail_abundance_frequency_counts = []
+        self.tail_incidence_frequency_counts = []
+
+    @property
+    def reference_sample_abundance(self) -> dict:
+        """
+        the exactly counted species of the abundance-based reference sample, demoted species cannot be listed
+        """
+        return self.vocabulary.to_dict(self.abundance_counts)
+
+    @property
+    def reference_sample_incidence(self) -> dict:
+        """
+        the exactly counted species of the incidence-based reference sample, demoted species cannot be listed
+        """
+        return self.vocabulary.to_dict(self.incidence_counts)
+
+    @staticmethod
+    def fingerprint(species) -> int:
+        """
+        returns the 64-bit fingerprint of a species. Species are hashed by their representation, so that fingerprints
+        remain valid across processes
+        """
+        return int.from_bytes(hashlib.blake2b(repr(species).encode("utf-8"), digest_size=8).digest(), "little")
+
+    @staticmethod
+    def sketch_indices(fingerprint: int, width: int) -> list:
+        """
+        returns the positions of the counters of a species in a flattened sketch of the given width
+        """
+        h1 = fingerprint & 0xFFFFFFFF
+        h2 = (fingerprint >> 32) | 1
+        return [row * width + (h1 + row * h2) % width for row in range(SKETCH_DEPTH)]
+
+    def segment_width(self, segment: int) -> int:
+        """
+        returns the number of counters per row of the sketches of a segment
+        """
+        return len(self.abundance_sketches[segment]) // SKETCH_DEPTH
+
+    def find_demoted(self, species: list) -> dict:
+        """
+        looks up which of the given species have been demoted
+        :param species: distinct species that are not counted exactly
+        :return: the segment, the position within the segment and the counter positions of each demoted species
+        """
+        fingerprints = np.array([BoundedMetricManager.fingerprint(s) for s in species], dtype=np.uint64)
+        demoted = {}
+        for segment, demoted_fingerprints in enumerate(self.demoted_fingerprints):
+            if len(demoted_fingerprints) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(demoted_fingerprints, fingerprints), len(demoted_fingerprints) - 1)
+            width = self.segment_width(segment)
+            for k in np.flatnonzero(demoted_fingerprints[positions] == fingerprints).tolist():
+                demoted[species[k]] = (segment, int(positions[k]),
+                                       BoundedMetricManager.sketch_indices(int(fingerprints[k]), width))
+        return demoted
+
+    def add_species(self, species_abundance: list) -> None:
+        ids = self.vocabulary.ids
+        demoted = {}
+        if self.no_demoted > 0:
+            candidates = [s for s in set(species_abundance) if s not in ids]
+            if candidates:
+                demoted = self.find_demoted(candidates)
+        exact = [s for s in species_abundance if s not in demoted] if demoted else species_abundance
+
+        # running sums are derived from the combined frequency counts at each checkpoint instead
+        species_ids = self.vocabulary.intern_all(exact)
+        self.ensure_capacity(len(self.vocabulary))
+        MetricManager.add_counts(self.abundance_counts, self.exact_abundance_frequency_counts, species_ids)
+        MetricManager.add_counts(self.incidence_counts, self.exact_incidence_frequency_counts, set(species_ids))
+        for s in species_abundance:
+            if s in demoted:
+                segment, position, indices = demoted[s]
+                BoundedMetricManager.add_estimated_count(self.abundance_sketches[segment],
+                                                         self.tail_abundance_frequency_counts[segment], indices,
+                                                         self.abundance_estimates[segment], position)
+        for segment, position, indices in demoted.values():
+            BoundedMetricManager.add_estimated_count(self.incidence_sketches[segment],
+                                                     self.tail_incidence_frequency_counts[segment], indices,
+                                                     self.incidence_estimates[segment], position)
+
+        if len(self.vocabulary) > self.compaction_limit:
+            self.compact()
+
+    @staticmethod
+    def add_estimated_count(sketch: np.ndarray, frequency_counts: dict, indices: list, estimates: np.ndarray,
+                            position: int) -> None:
+        """
+        increments the count of a demoted species by one and moves it from the frequency class of its previous
+        estimate to the frequency class of its new estimate. The estimate may have grown by more than one since, through
+        other species sharing its counters
+        :param sketch: the flattened count-min sketch
+        :param frequency_counts: the frequency counts f_k of the demoted species
+        :param indices: the positions of the counters of the species
+        :param estimates: the estimated counts of the demoted species at their latest observation
+        :param position: the position of the species in the estimates
+        """
+        view = memoryview(sketch)
+        k = min(view[i] for i in indices) + 1
+        for i in indices:
+            view[i] = view[i] + 1
+        previous = int(estimates[position])
+        estimates[position] = k
+        if frequency_counts[previous] == 1:
+            del frequency_counts[previous]
+        else:
+            frequency_counts[previous] = frequency_counts[previous] - 1
+        frequency_counts[k] = frequency_counts.get(k, 0) + 1
+
+    def add_segment(self) -> None:
+        """
+        adds a segment of sketches twice as wide as the previous one, or sketch_width wide if it is the first one
+        """
+        width = 2 * self.segment_width(-1) if self.abundance_sketches else self.sketch_width
+        self.abundance_sketches.append(np.zeros(SKETCH_DEPTH * width, dtype=np.int64))
+        self.incidence_sketches.append(np.zeros(SKETCH_DEPTH * width, dtype=np.int64))
+        self.demoted_fingerprints.append(np.zeros(0, dtype=np.uint64))
+        self.abundance_estimates.append(np.zeros(0, dtype=np.int64))
+        self.incidence_estimates.append(np.zeros(0, dtype=np.int64))
+        self.tail_abundance_frequency_counts.append({})
+        self.tail_incidence_frequency_counts.append({})
+
+    def compact(self) -> None:
+        """
+        demotes the most frequent species to the sketches until half of the budget of exactly counted species is free,
+        including their entries in the vocabulary. Species observed in at most EXACT_FREQUENCIES observations are kept
+        """
+        size = len(self.vocabulary)
+        # the incidence count of a species never exceeds its abundance count
+        candidates = np.flatnonzero(self.incidence_counts[:size] > EXACT_FREQUENCIES)
+        excess = min(size - self.max_species // 2, len(candidates))
+        if excess > 0:
+            demote = candidates[np.argpartition(-self.incidence_counts[candidates], excess - 1)[:excess]].tolist()
+            position = 0
+            while position < excess:
+                free = self.segment_width(-1) - len(self.demoted_fingerprints[-1]) if self.abundance_sketches else 0
+                if free == 0:
+                    self.add_segment()
+                    continue
+                batch = demote[position:position + free]
+                self.__demote(batch)
+                position = position + len(batch)
+            self.no_demoted = self.no_demoted + excess
+
+            keep = np.setdiff1d(np.arange(size), demote)
+            vocabulary = SpeciesVocabulary()
+            vocabulary.intern_all([self.vocabulary.species[i] for i in keep.tolist()])
+            self.vocabulary = vocabulary
+            for name in ("abundance_counts", "incidence_counts"):
+                counts = np.zeros(max(len(keep), INITIAL_CAPACITY), dtype=np.int64)
+                counts[:len(keep)] = getattr(self, name)[keep]
+                setattr(self, name, counts)
+        # if too few species can be demoted, the budget is exceeded rather than compacting after every observation
+        self.compaction_limit = max(self.max_species, 2 * len(self.vocabulary))
+
+    def __demote(self, species_ids: list) -> None:
+        """
+        moves the counts of exactly counted species to the sketches of the latest segment, which must have room for
+        all of them
+        """
+        width = self.segment_width(-1)
+        abundance_sketch = memoryview(self.abundance_sketches[-1])
+        incidence_sketch = memoryview(self.incidence_sketches[-1])
+        fingerprints = []
+        abundance_estimates = []
+        incidence_estimates = []
+        for i in species_ids:
+            fingerprint = BoundedMetricManager.fingerprint(self.vocabulary.species[i])
+            indices = BoundedMetricManager.sketch_indices(fingerprint, width)
+            fingerprints.append(fingerprint)
+            for sketch, counts, exact, tail, estimates in (
+                    (abundance_sketch, self.abundance_counts, self.exact_abundance_frequency_counts,
+                     self.tail_abundance_frequency_counts[-1], abundance_estimates),
+                    (incidence_sketch, self.incidence_counts, self.exact_incidence_frequency_counts,
+                     self.tail_incidence_frequency_counts[-1], incidence_estimates)):
+                count = int(counts[i])
+                for j in indices:
+                    sketch[j] = sketch[j] + count
+                # the estimate may already exceed the count, through other species sharing its counters
+                k = min(sketch[j] for j in indices)
+                estimates.append(k)
+                if exact[count] == 1:
+                    del exact[count]
+                else:
+                    exact[count] = exact[count] - 1
+                tail[k] = tail.get(k, 0) + 1
+        fingerprints = np.concatenate((self.demoted_fingerprints[-1], np.array(fingerprints, dtype=np.uint64)))
+        order = np.argsort(fingerprints, kind="stable")
+        self.demoted_fingerprints[-1] = fingerprints[order]
+        self.abundance_estimates[-1] = np.concatenate((self.abundance_estimates[-1],
+                                                       np.array(abundance_estimates, dtype=np.int64)))[order]
+        self.incidence_estimates[-1] = np.concatenate((self.incidence_estimates[-1],
+                                                       np.array(incidence_estimates, dtype=np.int64)))[order]
+
+    def frequency_counts(self, model: str) -> dict:
+        """
+        returns the combined frequency counts of exactly counted and demoted species
+        :param model: "abundance" or "incidence"
+        :return: the frequency counts f_k
+        """
+        frequency_counts = dict(getattr(self, "exact_" + model + "_frequency_counts"))
+        for tail in getattr(self, "tail_" + model + "_frequency_counts"):
+            for k, f_k in tail.items():
+                frequency_counts[k] = frequency_counts.get(k, 0) + f_k
+        return frequency_counts
+
+    def current_sample(self, model: str) -> tuple:
+        # the frequency counts of the model are only combined at each checkpoint
+        return getattr(self, model + "_sample_size"), self.frequency_counts(model)
+
+    def new_checkpoint(self) -> None:
+        """
+        starts a new checkpoint, combining the frequency counts of exactly counted and demoted species
+        """
+        self.abundance_frequency_counts = self.frequency_counts("abundance")
+        self.incidence_frequency_counts = self.frequency_counts("incidence")
+        self.abundance_sum_x_log_x, self.abundance_sum_squares = MetricManager.sums(self.abundance_frequency_counts)
+        self.incidence_sum_x_log_x, self.incidence_sum_squares = MetricManager.sums(self.incidence_frequency_counts)
+        super().new_checkpoint()
+
+    def count_errors(self, model: str) -> list:
+        """
+        returns the amount by which the estimated count of a demoted species exceeds its true count at most, with
+        probability 1 - exp(-depth), for each segment. Each row of a sketch holds the total count of its species, of
+        which the counter of a species receives e/width at most with probability 1 - 1/e, hence the bound is taken
+        from the row with the smallest total
+        :param model: "abundance" or "incidence"
+        :return: the count error of each segment
+        """
+        count_errors = []
+        for segment, sketch in enumerate(getattr(self, model + "_sketches")):
+            width = self.segment_width(segment)
+            row_totals = sketch.reshape(SKETCH_DEPTH, width).sum(axis=1)
+            count_errors.append(math.ceil(math.e / width * int(row_totals.min())))
+        return count_errors
+
+    def error_bounds(self) -> dict:
+        """
+        returns bounds on the sample-based D0, D1 and D2, the estimated D0 and C1 of the current reference samples.
+        Counts of demoted species exceed their true counts by at most the count error of their segment with
+        probability 1 - failure_probability. As demoted species are never mistaken for new ones and are observed more
+        than EXACT_FREQUENCIES times, the number of species, singletons and doubletons are exact, and so are D0 and
+        the estimated D0. D1, D2 and C1 depend on the counts of demoted species
+        :return: the failure probability, and for each model the count error of each segment and a (lower, upper)
+        pair of each metric
+        """
+        bounds = {"failure_probability": math.exp(-SKETCH_DEPTH)}
+        for model in ("abundance", "incidence"):
+            frequency_counts = self.frequency_counts(model)
+            total = getattr(self, model + "_current_total_species_count")
+            sample_size = getattr(self, model + "_sample_size")
+            sum_x_log_x, sum_squares = MetricManager.sums(frequency_counts)
+            count_errors = self.count_errors(model)
+
+            # the frequency classes of demoted species are their estimates at their latest observation, which exceed
+            # their true counts by at most the count error of their segment, while the true counts add up to the
+            # exactly known total. The sums of x*log(x) and x^2 are smallest if the largest counts are lowered first,
+            # down to a common level
+            exact = getattr(self, "exact_" + model + "_frequency_counts")
+            tails = getattr(self, "tail_" + model + "_frequency_counts")
+            ranges = [(max(k - count_error, EXACT_FREQUENCIES + 1), k, f_k)
+                      for tail, count_error in zip(tails, count_errors) for k, f_k in tail.items()]
+            level = BoundedMetricManager.fill_level(ranges, total - sum(k * f_k for k, f_k in exact.items()))
+            lowest = dict(exact)
+            for low, high, f_k in ranges:
+                k = min(max(level, low), high)
+                lowest[k] = lowest.get(k, 0) + f_k
+            lowest_x_log_x, lowest_squares = MetricManager.sums(lowest)
+
+            observed = get_number_observed_species(None, frequency_counts)
+            estimate_d0 = estimate_species_richness_chao(None, frequency_counts)
+            bounds[model] = {
+                "count_errors": count_errors,
+                "sample_d0": (observed, observed),
+                "sample_d1": (entropy_exp_from_sums(sum_x_log_x, total), entropy_exp_from_sums(lowest_x_log_x, total)),
+                "sample_d2": (simpson_diversity_from_sums(sum_squares, total),
+                              simpson_diversity_from_sums(lowest_squares, total)),
+                "estimate_d0": (estimate_d0, estimate_d0),
+                # the lowered counts add up to the true total count, on which the coverage depends besides f1 and f2
+                "c1": (coverage(None, sample_size, lowest), coverage(None, sample_size, lowest))
+            }
+        return bounds
+
+    @staticmethod
+    def fill_level(ranges: list, total: int) -> float:
+        """
+        returns the level down to which counts have to be lowered, each within its range, such that they add up to
+        the given total
+        :param ranges: the lowest and highest count of each frequency class, and the number of species in it
+        :param total: the total count of all species of the frequency classes
+        :return: the level, or the highest count if the counts do not exceed the total
+        """
+        if not ranges:
+            return 0
+        low = min(r[0] for r in ranges)
+        high = max(r[1] for r in ranges)
+        for _ in range(FILL_LEVEL_ITERATIONS):
+            middle = (low + high) / 2
+            if sum(f_k * min(max(middle, lowest), highest) for lowest, highest, f_k in ranges) > total:
+                high = middle
+            else:
+                low = middle
+        return high
+
+    def add_weighted_species(self, species_abundance: list, multiplicity: int) -> None:
+        raise RuntimeError('Cannot add weighted species to bounded reference samples')
+
+    def remove_species(self, species_abundance: list) -> None:
+        raise RuntimeError('Cannot remove species from bounded reference samples')
+
+    def merge(self, other: "MetricManager") -> "MetricManager":
+        raise RuntimeError('Cannot merge bounded reference samples')
+
+
+# traces shared with the worker processes of a parallel profiling run, set once per worker by its initializer
+_worker_traces = None
+
+
+def _init_worker(traces: list) -> None:
+    global _worker_traces
+    _worker_traces = traces
+
+
+def _profile_in_worker(estimator: "SpeciesEstimator") -> "SpeciesEstimator":
+    estimator._profile(_worker_traces, "Profiling Log for " + next(iter(estimator.species_retrieval)))
+    return estimator
 
 
 class SpeciesEstimator:
@@ -82,7 +1007,9 @@ class SpeciesEstimator:
 
     def __init__(self, d0: bool = True, d1: bool = False, d2: bool = False, c0: bool = True,
                  c1: bool = True,
-                 l_n: list = [.9, .95, .99], step_size: int | None = None):
+                 l_n: list = [.9, .95, .99], step_size: int | None = None, n_jobs: int | None = None,
+                 lazy: bool = False, schedule: CheckpointSchedule | None = None, decay: float | None = None,
+                 instrument: bool = False, max_species: int | None = None, deduplicate: bool = False):
         """
         :param species_retrieval_function: a function mapping a trace to a list of corresponding species
         :param d0: flag indicating if D0(=species richness) should be included
@@ -92,7 +1019,26 @@ class SpeciesEstimator:
         :param c1: flag indicating if C1(=coverage) should be included
         :param l_n: list of desired completeness values for estimation additional sampling effort
         :param step_size: the number of added traces after which the profiles are updated. Use None if
+        :param n_jobs: the number of worker processes used to profile the registered species definitions in parallel.
+        Use -1 for one process per CPU, or None to profile all species definitions in the current process
+        :param lazy: flag indicating if diversity and completeness metrics should only be computed on first access,
+        from snapshots of the frequency counts taken at each checkpoint
+        :param schedule: the schedule deciding after which traces the profiles are updated, e.g. a GeometricSchedule.
+        If set, it takes precedence over step_size
+        :param decay: the rate of exponential decay per added trace. If set, each observed species is weighted by
+        exp(-decay * age), where age is the number of traces added since, so that the profiles follow the recent
+        behaviour of the process. Use None to weight all observations equally
+        :param instrument: flag indicating if the time spent in each phase of profiling should be recorded, see timer
+        :param max_species: the memory budget, as the number of species per species definition whose counts are kept
+        exactly. If set, the most frequent species beyond it are counted approximately, see BoundedMetricManager and
+        its error_bounds. Use None to count all species exactly
+        :param deduplicate: flag indicating if species are retrieved only once per trace variant, i.e. distinct
+        activity sequence. Requires all species retrieval functions to be activity-based, and is ignored otherwise.
+        If no profiles are recorded before the end of the log, each variant is added once, weighted by its number of
+        traces
         """
+        if decay is not None and max_species is not None:
+            raise RuntimeError('Cannot bound the number of species of decayed reference samples')
         # TODO add differentiation between abundance and incidence based data
         self.include_abundance = True
         self.include_incidence = True
@@ -107,41 +1053,118 @@ class SpeciesEstimator:
         self.l_n = l_n
 
         self.step_size = step_size
+        self.n_jobs = n_jobs
+        self.lazy = lazy
+        self.schedule = schedule
+        self.decay = decay
+        self.max_species = max_species
+        self.deduplicate = deduplicate
+        # records time per phase, species definition and metric if instrumentation is enabled
+        self.timer = PhaseTimer() if instrument else NullTimer()
 
         self.metrics = {}
         self.species_retrieval = {}
+        self.schedules = {}
 
     def register(self, species_id: str, function: Callable) -> None:
+        if not callable(function):
+            raise RuntimeError('Cannot register ' + type(function).__name__ + ' as species retrieval function')
         self.species_retrieval[species_id] = function
-        self.metrics[species_id] = MetricManager(self.include_d0, self.include_d1, self.include_d2, self.include_c0,
-                                                 self.include_c1, self.l_n)
+        if self.decay is not None:
+            self.metrics[species_id] = DecayedMetricManager(self.include_d0, self.include_d1, self.include_d2,
+                                                            self.include_c0, self.include_c1, self.l_n, self.lazy,
+                                                            self.decay)
+        elif self.max_species is not None:
+            self.metrics[species_id] = BoundedMetricManager(self.include_d0, self.include_d1, self.include_d2,
+                                                            self.include_c0, self.include_c1, self.l_n, self.lazy,
+                                                            self.max_species)
+        else:
+            self.metrics[species_id] = MetricManager(self.include_d0, self.include_d1, self.include_d2,
+                                                     self.include_c0, self.include_c1, self.l_n, self.lazy)
+        if self.schedule is not None:
+            self.schedules[species_id] = copy.deepcopy(self.schedule)
 
-    def apply(self, data: pd.DataFrame | EventLog | Trace) -> None:
+    def merge(self, other: "SpeciesEstimator") -> None:
+        """
+        merges the reference samples of another estimator, e.g. one profiling a different shard of the same event log,
+        into this estimator and recomputes the diversity and completeness profiles from the merged counts. The
+        profiles of the merged estimator consist of a single checkpoint covering all merged observations
+        :param other: the estimator to merge, using the same species definitions
+        """
+        if self.species_retrieval.keys() != other.species_retrieval.keys():
+            raise RuntimeError('Cannot merge estimators with different species definitions')
+        for species_id in self.species_retrieval.keys():
+            other_metrics = self._translate_species(species_id, other.metrics[species_id],
+                                                    other.species_retrieval[species_id])
+            self.metrics[species_id] = self.metrics[species_id].merge(other_metrics)
+            self.update_metrics(species_id)
+
+    def _translate_species(self, species_id: str, manager: MetricManager, function: Callable) -> MetricManager:
+        """
+        translates the species of a metric manager retrieved by another instance of a species retrieval function,
+        e.g. of a merged estimator, into the species of the instance registered with this estimator. Only applies to
+        functions encoding species by codes assigned on first sight, such as PackedNGram
+        :param species_id: the species definition
+        :param manager: the metrics holding the species retrieved by the other instance
+        :param function: the other instance of the species retrieval function
+        :return: the metrics holding the translated species
+        """
+        own_function = self.species_retrieval[species_id]
+        if function is own_function or not hasattr(own_function, "translate"):
+            return manager
+        species = own_function.translate(manager.vocabulary.species, function)
+        if species is manager.vocabulary.species:
+            return manager
+        # codes are translated one-to-one, hence only the vocabulary changes
+        translated = copy.copy(manager)
+        translated.vocabulary = SpeciesVocabulary()
+        translated.vocabulary.intern_all(species)
+        return translated
+
+    def save(self, path: str) -> None:
+        """
+        writes the estimator, including its reference samples, profiles and configuration, to a binary file
+        :param path: the path of the file
+        """
+        from special.estimation.persistence import save_estimator
+        save_estimator(self, path)
+
+    @staticmethod
+    def load(path: str, species_retrieval: dict | None = None) -> "SpeciesEstimator":
+        """
+        reads an estimator written by save. Reference samples and profiles are memory-mapped from the file
+        :param path: the path of the file
+        :param species_retrieval: species retrieval functions by species id, required for functions that cannot be
+        imported by name, e.g. lambdas
+        :return: the loaded estimator
+        """
+        from special.estimation.persistence import load_estimator
+        return load_estimator(path, species_retrieval)
+
+    def apply(self, data: pd.DataFrame | EventLog | Trace | list) -> None:
         """
         add all observations of an event log and update diversity and completeness profiles once afterward.
         If parameter step_size is set to an int, profiles are additionally updated along the way according to
         the step size
-        :param data: the event log containing the trace observations
+        :param data: the event log containing the trace observations. Data frames are split into the activity
+        sequences of their cases directly, if all registered species retrieval functions are activity-based or
+        batch-based
         """
+        retrieved = {}
         if isinstance(data, pd.DataFrame):
-            return self.apply(pm4py.convert_to_event_log(data))
-        if isinstance(data, EventLog):
+            with self.timer.measure("conversion"):
+                data, retrieved = self._convert_frame(data)
+        if isinstance(data, (EventLog, list)):
             if self.step_size is not None:
                 if len(data) <= self.step_size:
                     self.step_size = 1
                 else:
                     self.step_size = int(len(data)/self.step_size)
-            for species_id in self.species_retrieval.keys():
-                for tr in tqdm(data, "Profiling Log for " + species_id):
-                    self.add_observation(tr, species_id)
-                    # if step size is set, update metrics after <step_size> many traces
-                    if self.step_size is None:
-                        continue
-                    elif self.metrics[species_id].incidence_sample_size % self.step_size == 0:
-                        self.update_metrics(species_id)
-                self.update_metrics(species_id)
-
-                #self.apply(tr)
+            with self.timer.measure("profiling"):
+                if self.n_jobs is not None and self.n_jobs != 1 and len(self.species_retrieval) > 1 and not retrieved:
+                    self._profile_parallel(data)
+                else:
+                    self._profile(data, retrieved=retrieved)
             return
         if isinstance(data, Trace):
             pass
@@ -155,39 +1178,235 @@ class SpeciesEstimator:
         else:
             raise RuntimeError('Cannot apply data of type ' + str(type(data)))
 
-    def add_observation(self, observation: Trace, species_id: str) -> None:
+    def extend(self, data: pd.DataFrame | EventLog | Iterable) -> None:
+        """
+        continues profiling on traces appended to a previously profiled log, e.g. after loading a saved estimator.
+        Unlike apply, the step size resolved by the first call to apply is kept, so that checkpoints continue on the
+        same schedule. The checkpoint recorded at the end of the previous data is replaced by the new checkpoints
+        :param data: the appended traces
+        """
+        for manager in self.metrics.values():
+            if manager.closing_checkpoint:
+                manager.remove_checkpoint()
+        retrieved = {}
+        if isinstance(data, pd.DataFrame):
+            with self.timer.measure("conversion"):
+                data, retrieved = self._convert_frame(data)
+        with self.timer.measure("profiling"):
+            if isinstance(data, (EventLog, list)) and self.n_jobs is not None and self.n_jobs != 1 and len(
+                    self.species_retrieval) > 1 and not retrieved:
+                self._profile_parallel(data)
+            else:
+                self._profile(data, "Extending Profile", retrieved)
+
+    def _convert_frame(self, data: pd.DataFrame) -> tuple:
+        """
+        splits a data frame-based event log into traces. Species of batch-based species retrieval functions are
+        retrieved for all cases at once, and traces are given as activity sequences if all remaining functions are
+        activity-based
+        :param data: the data frame containing the events
+        :return: the traces, and the species retrieved by each batch-based function for each trace
+        """
+        retrieved = {}
+        for species_id, function in self.species_retrieval.items():
+            if is_batch_based(function):
+                with self.timer.measure("retrieval", species_id):
+                    retrieved[species_id] = function.retrieve_batch(data)
+        if all(is_activity_based(f) for species_id, f in self.species_retrieval.items() if species_id not in retrieved):
+            return get_activity_sequences(data), retrieved
+        return pm4py.convert_to_event_log(data), retrieved
+
+    def apply_stream(self, traces: Iterable) -> None:
+        """
+        add all observations of a stream of traces, e.g. from an incremental log reader or a simulation, and update
+        diversity and completeness profiles once afterward. Traces are consumed one at a time and only the reference
+        samples and profiles are kept in memory. As the length of the stream is not known in advance, parameter
+        step_size is used as the number of traces between two profile updates
+        :param traces: an iterable of traces, either pm4py traces or activity sequences
+        """
+        with self.timer.measure("profiling"):
+            self._profile(traces, "Profiling Stream")
+
+    def _profile(self, data: Iterable, description: str = "Profiling Log", retrieved: dict | None = None) -> None:
+        """
+        adds all traces of the log for every registered species definition and updates the profiles according to the
+        schedule or step size, as well as once afterward
+        :param data: the traces to be added
+        :param description: the description of the progress bar
+        :param retrieved: the species already retrieved for each trace, by species id, e.g. by batch-based functions
+        """
+        # traces are walked once, and their activity sequence is extracted once for all species definitions
+        retrieved = retrieved or {}
+        extract_activities = all(is_activity_based(f) for species_id, f in self.species_retrieval.items()
+                                 if species_id not in retrieved)
+        if self.deduplicate and extract_activities and not retrieved:
+            self._profile_variants(data, description)
+            return
+        if retrieved:
+            for i, tr in enumerate(tqdm(data, description)):
+                self.add_trace(tr, extract_activities, {species_id: species[i] for species_id, species in
+                                                        retrieved.items()})
+        else:
+            for tr in tqdm(data, description):
+                self.add_trace(tr, extract_activities)
+        for species_id in self.species_retrieval.keys():
+            self.update_metrics(species_id)
+            self.metrics[species_id].closing_checkpoint = True
+
+    def _profile_variants(self, data: Iterable, description: str = "Profiling Log") -> None:
+        """
+        adds all traces of the log, retrieving the species of each trace variant only once. Profiles are updated
+        according to the schedule or step size by replaying the variants in the order of the traces. If the profiles
+        are only updated once afterward and the reference samples do not depend on the order of the traces, each
+        variant is added once instead, weighted by its number of traces
+        :param data: the traces to be added
+        :param description: the description of the progress bar
+        """
+        weighted = self.step_size is None and not self.schedules and self.decay is None and self.max_species is None
+        variants = {}
+        multiplicities = []
+        species = {species_id: [] for species_id in self.species_retrieval.keys()}
+        for tr in tqdm(data, description):
+            self.timer.count_traces()
+            with self.timer.measure("activity_extraction"):
+                variant = tuple(get_activities(tr))
+            v = variants.get(variant)
+            if v is None:
+                v = variants[variant] = len(variants)
+                multiplicities.append(0)
+                # the same sequence is handed to all functions, which allows them to share work
+                activities = list(variant)
+                for species_id, function in self.species_retrieval.items():
+                    with self.timer.measure("retrieval", species_id):
+                        species[species_id].append(function(activities))
+            if weighted:
+                multiplicities[v] = multiplicities[v] + 1
+                continue
+            for species_id in self.species_retrieval.keys():
+                self.add_retrieved_species(species[species_id][v], species_id)
+                if self.is_checkpoint(species_id):
+                    self.update_metrics(species_id)
+        if weighted:
+            for species_id in self.species_retrieval.keys():
+                for species_abundance, multiplicity in zip(species[species_id], multiplicities):
+                    self.add_retrieved_species(species_abundance, species_id, multiplicity)
+        for species_id in self.species_retrieval.keys():
+            self.update_metrics(species_id)
+            self.metrics[species_id].closing_checkpoint = True
+
+    def add_trace(self, trace: Trace | list, extract_activities: bool = False, retrieved: dict | None = None) -> None:
+        """
+        adds a single trace for every registered species definition and updates the profiles if a checkpoint is due
+        :param trace: the trace to be added
+        :param extract_activities: flag indicating if the activity sequence of the trace should be extracted once
+        and handed to all species retrieval functions, which requires all of them to be activity-based
+        :param retrieved: the species already retrieved from the trace, by species id
+        """
+        self.timer.count_traces()
+        if extract_activities:
+            with self.timer.measure("activity_extraction"):
+                observation = get_activities(trace)
+        else:
+            observation = trace
+        for species_id in self.species_retrieval.keys():
+            if retrieved is not None and species_id in retrieved:
+                self.add_retrieved_species(retrieved[species_id], species_id)
+            else:
+                self.add_observation(observation, species_id)
+            if self.is_checkpoint(species_id):
+                self.update_metrics(species_id)
+
+    def is_checkpoint(self, species_id: str) -> bool:
+        """
+        returns whether the profiles of a species definition should be updated after the latest observation
+        :param species_id: the species definition
+        :return: true if a checkpoint is due, according to the schedule or step size
+        """
+        if species_id in self.schedules:
+            return self.schedules[species_id].is_checkpoint(self.metrics[species_id])
+        # if step size is set, update metrics after <step_size> many traces
+        if self.step_size is None:
+            return False
+        return self.metrics[species_id].no_observations % self.step_size == 0
+
+    def _profile_parallel(self, data: EventLog | list) -> None:
+        """
+        profiles each registered species definition in a separate worker process and merges the resulting metrics
+        back into this estimator
+        :param data: the traces to be added
+        """
+        if all(is_activity_based(f) for f in self.species_retrieval.values()):
+            # activity sequences are much cheaper to hand over to the workers than pm4py traces
+            data = [get_activities(tr) for tr in data]
+        n_workers = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        n_workers = min(n_workers, len(self.species_retrieval))
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(data,)) as executor:
+            futures = {}
+            for species_id in self.species_retrieval.keys():
+                # each worker continues from the current state of its species definition
+                worker_estimator = copy.copy(self)
+                worker_estimator.n_jobs = None
+                # workers record their measurements from scratch, which are then added to those of this estimator
+                worker_estimator.timer = type(self.timer)()
+                worker_estimator.species_retrieval = {species_id: self.species_retrieval[species_id]}
+                worker_estimator.metrics = {species_id: self.metrics[species_id]}
+                worker_estimator.schedules = {species_id: self.schedules[species_id]} \
+                    if species_id in self.schedules else {}
+                futures[species_id] = executor.submit(_profile_in_worker, worker_estimator)
+            for species_id, future in futures.items():
+                worker_function = future.result().species_retrieval[species_id]
+                if hasattr(self.species_retrieval[species_id], "translate"):
+                    # activity codes assigned by the worker are taken over by the instance of this estimator, which
+                    # may be shared by several species definitions, e.g. the orders of an NGramOrders instance
+                    self.metrics[species_id] = self._translate_species(species_id, future.result().metrics[species_id],
+                                                                       worker_function)
+                else:
+                    self.metrics[species_id] = future.result().metrics[species_id]
+                    # retrieval functions may keep state
+                    self.species_retrieval[species_id] = worker_function
+                self.timer.merge(future.result().timer)
+                self.schedules.update(future.result().schedules)
+        self.timer.count_traces(len(data))
+
+    def add_observation(self, observation: Trace | list, species_id: str) -> None:
         """
         adds a single observation
-        :param observation: the trace observation
+        :param observation: the trace observation, or its sequence of activity labels
         """
         # retrieve species from current observation
-        species_abundance = self.species_retrieval[species_id](observation)
+        with self.timer.measure("retrieval", species_id):
+            species_abundance = self.species_retrieval[species_id](observation)
+        self.add_retrieved_species(species_abundance, species_id)
+
+    def add_retrieved_species(self, species_abundance: list, species_id: str, multiplicity: int = 1) -> None:
+        """
+        adds the species retrieved from an observation, which may have been made several times
+        :param species_abundance: the species retrieved from the observation, including repetitions
+        :param multiplicity: the number of times the observation was made
+        """
         species_incidence = set(species_abundance)
         self.metrics[species_id].trace_retrieved_species_abundance = species_abundance
         self.metrics[species_id].trace_retrieved_species_incidence = species_incidence
 
         # update species abundances/incidences
-        for s in species_abundance:
-            self.metrics[species_id].reference_sample_abundance[s] = self.metrics[
-                                                                         species_id].reference_sample_abundance.get(s,
-                                                                                                                    0) + 1
-
-        for s in species_incidence:
-            self.metrics[species_id].reference_sample_incidence[s] = self.metrics[
-                                                                         species_id].reference_sample_incidence.get(s,
-                                                                                                                    0) + 1
+        with self.timer.measure("counting", species_id):
+            if multiplicity == 1:
+                self.metrics[species_id].add_species(species_abundance)
+            else:
+                self.metrics[species_id].add_weighted_species(species_abundance, multiplicity)
 
         # update current number of observation for each model
         self.metrics[species_id].abundance_sample_size = self.metrics[species_id].abundance_sample_size + len(
-            species_abundance)
-        self.metrics[species_id].incidence_sample_size = self.metrics[species_id].incidence_sample_size + 1
+            species_abundance) * multiplicity
+        self.metrics[species_id].incidence_sample_size = self.metrics[species_id].incidence_sample_size + multiplicity
 
         # update current sum of all observed species for each model
         self.metrics[species_id].abundance_current_total_species_count = \
-            self.metrics[species_id].abundance_current_total_species_count + len(species_abundance)
+            self.metrics[species_id].abundance_current_total_species_count + len(species_abundance) * multiplicity
         self.metrics[species_id].incidence_current_total_species_count = \
             self.metrics[species_id].incidence_current_total_species_count + len(
-                species_incidence)
+                species_incidence) * multiplicity
 
         #update current degree of spatial aggregation
         self.metrics[species_id].current_spatial_aggregation = 1 - (
@@ -198,119 +1417,171 @@ class SpeciesEstimator:
         """
         updates the diversity and completeness profiles based on the current observations
         """
-        # update number of observations so far
-        self.metrics[species_id]["abundance_no_observations"].append(self.metrics[species_id].abundance_sample_size)
-        self.metrics[species_id]["incidence_no_observations"].append(self.metrics[species_id].incidence_sample_size)
-
-        #update number of species seen so far
-        self.metrics[species_id]["abundance_sum_species_counts"].append(
-            self.metrics[species_id].abundance_current_total_species_count)
-        self.metrics[species_id]["incidence_sum_species_counts"].append(
-            self.metrics[species_id].incidence_current_total_species_count)
-
-        #update degree of spatial aggregation
-        self.metrics[species_id]["degree_of_aggregation"].append(self.metrics[species_id].current_spatial_aggregation)
-
-        #update singleton and doubleton counts
-        self.metrics[species_id]["abundance_singletons"].append(
-            get_singletons(self.metrics[species_id].reference_sample_abundance))
-        self.metrics[species_id]["incidence_singletons"].append(
-            get_singletons(self.metrics[species_id].reference_sample_incidence))
-
-        self.metrics[species_id]["abundance_doubletons"].append(
-            get_doubletons(self.metrics[species_id].reference_sample_abundance))
-        self.metrics[species_id]["incidence_doubletons"].append(
-            get_doubletons(self.metrics[species_id].reference_sample_incidence))
-
-        #update diversity profile
-        if self.include_d0:
-            self.__update_d0(species_id)
-        if self.include_d1:
-            self.__update_d1(species_id)
-        if self.include_d2:
-            self.__update_d2(species_id)
-
-        #update completeness profile
-        if self.include_c0:
-            self.__update_c0(species_id)
-        if self.include_c1:
-            self.__update_c1(species_id)
-
-        #update estimated sampling effort for target completeness
-        for l in self.l_n:
-            self.__update_l(l, species_id)
+        with self.timer.measure("update_metrics", species_id):
+            self.metrics[species_id].new_checkpoint()
+            self.timer.record_growth(species_id, self.metrics[species_id].no_observations,
+                                     get_number_observed_species(
+                                         None, self.metrics[species_id].abundance_frequency_counts))
+
+            # update number of observations so far
+            self.metrics[species_id].record("abundance_no_observations", self.metrics[species_id].abundance_sample_size)
+            self.metrics[species_id].record("incidence_no_observations", self.metrics[species_id].incidence_sample_size)
+
+            #update number of species seen so far
+            self.metrics[species_id].record("abundance_sum_species_counts",
+                                            self.metrics[species_id].abundance_current_total_species_count)
+            self.metrics[species_id].record("incidence_sum_species_counts",
+                                            self.metrics[species_id].incidence_current_total_species_count)
+
+            #update degree of spatial aggregation
+            self.metrics[species_id].record("degree_of_aggregation",
+                                            self.metrics[species_id].current_spatial_aggregation)
+
+            #update singleton and doubleton counts
+            self.metrics[species_id].record("abundance_singletons",
+                                            get_singletons(self.metrics[species_id].abundance_counts,
+                                                           self.metrics[species_id].abundance_frequency_counts))
+            self.metrics[species_id].record("incidence_singletons",
+                                            get_singletons(self.metrics[species_id].incidence_counts,
+                                                           self.metrics[species_id].incidence_frequency_counts))
+
+            self.metrics[species_id].record("abundance_doubletons",
+                                            get_doubletons(self.metrics[species_id].abundance_counts,
+                                                           self.metrics[species_id].abundance_frequency_counts))
+            self.metrics[species_id].record("incidence_doubletons",
+                                            get_doubletons(self.metrics[species_id].incidence_counts,
+                                                           self.metrics[species_id].incidence_frequency_counts))
+
+            # in lazy mode, all remaining metrics are computed from the frequency counts on first access
+            if self.lazy:
+                self.metrics[species_id].record_snapshot()
+                return
+
+            #update diversity profile
+            if self.include_d0:
+                with self.timer.measure("update_d0", species_id):
+                    self.__update_d0(species_id)
+            if self.include_d1:
+                with self.timer.measure("update_d1", species_id):
+                    self.__update_d1(species_id)
+            if self.include_d2:
+                with self.timer.measure("update_d2", species_id):
+                    self.__update_d2(species_id)
+
+            #update completeness profile
+            if self.include_c0:
+                with self.timer.measure("update_c0", species_id):
+                    self.__update_c0(species_id)
+            if self.include_c1:
+                with self.timer.measure("update_c1", species_id):
+                    self.__update_c1(species_id)
+
+            #update estimated sampling effort for target completeness
+            for l in self.l_n:
+                with self.timer.measure("update_l_" + str(l), species_id):
+                    self.__update_l(l, species_id)
 
     def __update_d0(self, species_id: str) -> None:
         """
         updates D0 (=species richness) based on the current observations
         """
         #update sample metrics
-        self.metrics[species_id]["abundance_sample_d0"].append(len(self.metrics[species_id].reference_sample_abundance))
-        self.metrics[species_id]["incidence_sample_d0"].append(len(self.metrics[species_id].reference_sample_incidence))
+        self.metrics[species_id].record("abundance_sample_d0",
+                                        get_number_observed_species(
+                                            self.metrics[species_id].abundance_counts,
+                                            self.metrics[species_id].abundance_frequency_counts))
+        self.metrics[species_id].record("incidence_sample_d0",
+                                        get_number_observed_species(
+                                            self.metrics[species_id].incidence_counts,
+                                            self.metrics[species_id].incidence_frequency_counts))
 
         #update estimated metrics
-        self.metrics[species_id]["abundance_estimate_d0"].append(
-            hill_number_asymptotic(0, self.metrics[species_id].reference_sample_abundance,
-                                   self.metrics[species_id].abundance_sample_size))
-        self.metrics[species_id]["incidence_estimate_d0"].append(
-            hill_number_asymptotic(0, self.metrics[species_id].reference_sample_incidence,
-                                   self.metrics[species_id].incidence_sample_size, abundance=False))
+        self.metrics[species_id].record("abundance_estimate_d0",
+                                        hill_number_asymptotic(
+                                            0, self.metrics[species_id].abundance_counts,
+                                            self.metrics[species_id].abundance_sample_size,
+                                            frequency_counts=self.metrics[species_id].abundance_frequency_counts))
+        self.metrics[species_id].record("incidence_estimate_d0",
+                                        hill_number_asymptotic(
+                                            0, self.metrics[species_id].incidence_counts,
+                                            self.metrics[species_id].incidence_sample_size, abundance=False,
+                                            frequency_counts=self.metrics[species_id].incidence_frequency_counts))
 
     def __update_d1(self, species_id: str) -> None:
         """
         updates D1 (=exponential of Shannon entropy) based on the current observations
         """
         #update sample metrics
-        self.metrics[species_id]["abundance_sample_d1"].append(
-            entropy_exp(self.metrics[species_id].reference_sample_abundance))
-        self.metrics[species_id]["incidence_sample_d1"].append(
-            entropy_exp(self.metrics[species_id].reference_sample_incidence))
+        self.metrics[species_id].record("abundance_sample_d1",
+                                        entropy_exp_from_sums(
+                                            self.metrics[species_id].abundance_sum_x_log_x,
+                                            self.metrics[species_id].abundance_current_total_species_count))
+        self.metrics[species_id].record("incidence_sample_d1",
+                                        entropy_exp_from_sums(
+                                            self.metrics[species_id].incidence_sum_x_log_x,
+                                            self.metrics[species_id].incidence_current_total_species_count))
 
         #update estimated metrics
-        self.metrics[species_id]["abundance_estimate_d1"].append(
-            hill_number_asymptotic(1, self.metrics[species_id].reference_sample_abundance,
-                                   self.metrics[species_id].abundance_sample_size))
-        self.metrics[species_id]["incidence_estimate_d1"].append(
-            hill_number_asymptotic(1, self.metrics[species_id].reference_sample_incidence,
-                                   self.metrics[species_id].incidence_sample_size, abundance=False))
+        self.metrics[species_id].record("abundance_estimate_d1",
+                                        hill_number_asymptotic(
+                                            1, self.metrics[species_id].abundance_counts,
+                                            self.metrics[species_id].abundance_sample_size,
+                                            frequency_counts=self.metrics[species_id].abundance_frequency_counts))
+        self.metrics[species_id].record("incidence_estimate_d1",
+                                        hill_number_asymptotic(
+                                            1, self.metrics[species_id].incidence_counts,
+                                            self.metrics[species_id].incidence_sample_size, abundance=False,
+                                            frequency_counts=self.metrics[species_id].incidence_frequency_counts))
 
     def __update_d2(self, species_id: str) -> None:
         """
         updates D2 (=Simpson Diversity Index) based on the current observations
         """
         #update sample metrics
-        self.metrics[species_id]["abundance_sample_d2"].append(
-            simpson_diversity(self.metrics[species_id].reference_sample_abundance))
-        self.metrics[species_id]["incidence_sample_d2"].append(
-            simpson_diversity(self.metrics[species_id].reference_sample_incidence))
+        self.metrics[species_id].record("abundance_sample_d2",
+                                        simpson_diversity_from_sums(
+                                            self.metrics[species_id].abundance_sum_squares,
+                                            self.metrics[species_id].abundance_current_total_species_count))
+        self.metrics[species_id].record("incidence_sample_d2",
+                                        simpson_diversity_from_sums(
+                                            self.metrics[species_id].incidence_sum_squares,
+                                            self.metrics[species_id].incidence_current_total_species_count))
 
         #update estimated metrics
-        self.metrics[species_id]["abundance_estimate_d2"].append(
-            hill_number_asymptotic(2, self.metrics[species_id].reference_sample_abundance,
-                                   self.metrics[species_id].abundance_sample_size))
-        self.metrics[species_id]["incidence_estimate_d2"].append(
-            hill_number_asymptotic(2, self.metrics[species_id].reference_sample_incidence,
-                                   self.metrics[species_id].incidence_sample_size, abundance=False))
+        self.metrics[species_id].record("abundance_estimate_d2",
+                                        hill_number_asymptotic(
+                                            2, self.metrics[species_id].abundance_counts,
+                                            self.metrics[species_id].abundance_sample_size,
+                                            frequency_counts=self.metrics[species_id].abundance_frequency_counts))
+        self.metrics[species_id].record("incidence_estimate_d2",
+                                        hill_number_asymptotic(
+                                            2, self.metrics[species_id].incidence_counts,
+                                            self.metrics[species_id].incidence_sample_size, abundance=False,
+                                            frequency_counts=self.metrics[species_id].incidence_frequency_counts))
 
     def __update_c0(self, species_id: str) -> None:
         """
         updates C0 (=completeness) based on the current observations
         """
-        self.metrics[species_id]["abundance_c0"].append(
-            completeness(self.metrics[species_id].reference_sample_abundance))
-        self.metrics[species_id]["incidence_c0"].append(
-            completeness(self.metrics[species_id].reference_sample_incidence))
+        self.metrics[species_id].record("abundance_c0",
+                                        completeness(self.metrics[species_id].abundance_counts,
+                                                     self.metrics[species_id].abundance_frequency_counts))
+        self.metrics[species_id].record("incidence_c0",
+                                        completeness(self.metrics[species_id].incidence_counts,
+                                                     self.metrics[species_id].incidence_frequency_counts))
 
     def __update_c1(self, species_id: str) -> None:
         """
         updates C1 (=coverage) based on the current observations
         """
-        self.metrics[species_id]["abundance_c1"].append(
-            coverage(self.metrics[species_id].reference_sample_abundance,
-                     self.metrics[species_id].abundance_sample_size))
-        self.metrics[species_id]["incidence_c1"].append(
-            coverage(self.metrics[species_id].reference_sample_incidence,
-                     self.metrics[species_id].incidence_sample_size))
+        self.metrics[species_id].record("abundance_c1",
+                                        coverage(self.metrics[species_id].abundance_counts,
+                                                 self.metrics[species_id].abundance_sample_size,
+                                                 self.metrics[species_id].abundance_frequency_counts))
+        self.metrics[species_id].record("incidence_c1",
+                                        coverage(self.metrics[species_id].incidence_counts,
+                                                 self.metrics[species_id].incidence_sample_size,
+                                                 self.metrics[species_id].incidence_frequency_counts))
 
     def __update_l(self, g: float, species_id: str) -> None:
         """
@@ -318,12 +1589,14 @@ class SpeciesEstimator:
         observations
         :param g: desired  completeness
         """
-        self.metrics[species_id]["abundance_l_" + str(g)].append(
-            sampling_effort_abundance(g, self.metrics[species_id].reference_sample_abundance,
-                                      self.metrics[species_id].abundance_sample_size))
-        self.metrics[species_id]["incidence_l_" + str(g)].append(
-            sampling_effort_incidence(g, self.metrics[species_id].reference_sample_incidence,
-                                      self.metrics[species_id].incidence_sample_size))
+        self.metrics[species_id].record("abundance_l_" + str(g),
+                                        sampling_effort_abundance(g, self.metrics[species_id].abundance_counts,
+                                                                  self.metrics[species_id].abundance_sample_size,
+                                                                  self.metrics[species_id].abundance_frequency_counts))
+        self.metrics[species_id].record("incidence_l_" + str(g),
+                                        sampling_effort_incidence(g, self.metrics[species_id].incidence_counts,
+                                                                  self.metrics[species_id].incidence_sample_size,
+                                                                  self.metrics[species_id].incidence_frequency_counts))
 
     def print_metrics(self) -> None:
         """
@@ -381,14 +1654,104 @@ class SpeciesEstimator:
                 print("%-30s %s" % ("     l_" + str(l) + ":", str(self.metrics[species_id]["incidence_l_" + str(l)])))
             print()
 
-    def to_dataFrame(self) -> DataFrame:
+    def to_dataFrame(self, layout: str = "long") -> DataFrame:
         """
-        returns the diversity and completeness profile of the current observations as a data frame
+        returns the diversity and completeness profile of the current observations as a data frame. The columns are
+        built from the metric series directly, with species and metrics as categorical columns
+        :param layout: "long" for one row per species, metric and checkpoint, with columns species, metric,
+        observation and value, or "wide" for one row per species and checkpoint, with one column per metric
         :returns: a data frame view of the Diversity and Completeness Profile
         """
-        return pd.DataFrame([[i, j, ix, v]
-                             for i in self.metrics.keys()
-                             for j in self.metrics[i].keys()
-                             for ix, v in enumerate(self.metrics[i][j])
-                             ], columns=["species", "metric", "observation", "value"]
-                            )
\ No newline at end of file
+        species, metrics, series = self.__export_series()
+        if layout == "long":
+            return self.__long_frame(species, metrics, series)
+        if layout == "wide":
+            return self.__wide_frame(species, metrics, series)
+        raise RuntimeError('Cannot export profiles in unknown layout ' + str(layout))
+
+    def to_arrow(self, layout: str = "long"):
+        """
+        returns the diversity and completeness profile of the current observations as an Arrow table, with species
+        and metrics as dictionary-encoded columns. Requires pyarrow
+        :param layout: "long" or "wide", see to_dataFrame
+        :returns: an Arrow table of the Diversity and Completeness Profile
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise RuntimeError('Cannot export profiles to Arrow without pyarrow, install it with "pip install pyarrow"')
+        return pa.Table.from_pandas(self.to_dataFrame(layout), preserve_index=False)
+
+    def to_parquet(self, path: str, layout: str = "long") -> None:
+        """
+        writes the diversity and completeness profile of the current observations to a Parquet file. Requires pyarrow
+        :param path: the path of the file
+        :param layout: "long" or "wide", see to_dataFrame
+        """
+        table = self.to_arrow(layout)
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+
+    def __export_series(self) -> tuple:
+        """
+        collects the metric series of all species definitions
+        :return: the species ids, the union of their metric names and the series of each species definition
+        """
+        species = []
+        metrics = {}
+        series = []
+        for species_id, manager in self.metrics.items():
+            with self.timer.measure("export", species_id):
+                species.append(species_id)
+                series.append((manager.metric_names, manager.series_view()))
+            for name in manager.metric_names:
+                metrics.setdefault(name, len(metrics))
+        return species, list(metrics), series
+
+    def __long_frame(self, species: list, metrics: list, series: list) -> DataFrame:
+        """
+        builds the long layout, with one row per species, metric and checkpoint
+        """
+        metric_codes = {name: code for code, name in enumerate(metrics)}
+        species_codes, metric_columns, observations, values = [], [], [], []
+        for code, (names, view) in enumerate(series):
+            no_checkpoints, no_metrics = view.shape
+            species_codes.append(np.full(no_checkpoints * no_metrics, code, dtype=np.int32))
+            metric_columns.append(np.repeat(np.array([metric_codes[name] for name in names], dtype=np.int32),
+                                            no_checkpoints))
+            observations.append(np.tile(np.arange(no_checkpoints), no_metrics))
+            values.append(view.T.ravel())
+        if not series:
+            return pd.DataFrame({
+                "species": pd.Categorical([]),
+                "metric": pd.Categorical([]),
+                "observation": np.zeros(0, dtype=np.int64),
+                "value": np.zeros(0)
+            })
+        return pd.DataFrame({
+            "species": pd.Categorical.from_codes(np.concatenate(species_codes), categories=species),
+            "metric": pd.Categorical.from_codes(np.concatenate(metric_columns), categories=metrics),
+            "observation": np.concatenate(observations),
+            "value": np.concatenate(values)
+        })
+
+    def __wide_frame(self, species: list, metrics: list, series: list) -> DataFrame:
+        """
+        builds the wide layout, with one row per species and checkpoint and one column per metric
+        """
+        metric_codes = {name: code for code, name in enumerate(metrics)}
+        no_rows = sum(view.shape[0] for _, view in series)
+        values = np.full((no_rows, len(metrics)), np.nan)
+        species_codes = np.zeros(no_rows, dtype=np.int32)
+        observations = np.zeros(no_rows, dtype=np.int64)
+        row = 0
+        for code, (names, view) in enumerate(series):
+            no_checkpoints = view.shape[0]
+            values[row:row + no_checkpoints, [metric_codes[name] for name in names]] = view
+            species_codes[row:row + no_checkpoints] = code
+            observations[row:row + no_checkpoints] = np.arange(no_checkpoints)
+            row = row + no_checkpoints
+        frame = pd.DataFrame(values, columns=metrics, copy=False)
+        frame.insert(0, "observation", observations)
+        frame.insert(0, "species", pd.Categorical.from_codes(species_codes, categories=species))
+        return frame
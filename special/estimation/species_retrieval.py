@@ -1,12 +1,99 @@
 import math
+from abc import ABC, abstractmethod
+from collections import deque
 from datetime import datetime, timedelta
+from functools import partial
 
+import numpy as np
+import pandas as pd
 import pm4py
 
+# number of bits each activity code occupies in a packed n-gram, allowing for about a million distinct activities
+CODE_BITS = 20
+# codes of the artificial activities padding n-grams. Activities are numbered from 3 onwards, so that no n-gram is
+# packed to the key of the "NULL" species, 0
+START_CODE = 1
+END_CODE = 2
+
+def activity_based(function):
+    """
+    marks a species retrieval function that only depends on the activity labels of a trace. Such functions accept
+    traces given as a sequence of activity labels, which allows logs to be profiled without conversion to an EventLog
+    :param function: the species retrieval function
+    :return: the marked species retrieval function
+    """
+    function.activity_based = True
+    return function
+
+
+def is_activity_based(function) -> bool:
+    """
+    checks if a species retrieval function, possibly wrapped in a partial, only depends on the activity labels of a
+    trace
+    :param function: the species retrieval function
+    :return: True, if the function accepts traces given as a sequence of activity labels
+    """
+    while isinstance(function, partial):
+        function = function.func
+    return getattr(function, "activity_based", False)
+
+
+def is_batch_based(function) -> bool:
+    """
+    checks if a species retrieval function can retrieve the species of all cases of a data frame-based event log at
+    once, using its method retrieve_batch
+    :param function: the species retrieval function
+    :return: True, if the function supports batch retrieval
+    """
+    return getattr(function, "batch_based", False)
+
+
+def get_activities(trace) -> list:
+    """
+    returns the activity labels of a trace, which may be given either as a sequence of events or as a sequence of
+    activity labels
+    :param trace: the trace
+    :return: the activity labels of the trace
+    """
+    if len(trace) > 0 and isinstance(trace[0], str):
+        return list(trace)
+    return [x['concept:name'] for x in trace]
+
+
+def get_activity_sequences(log: pd.DataFrame, case_id_key: str = "case:concept:name",
+                           activity_key: str = "concept:name") -> list:
+    """
+    splits a data frame-based event log into the activity sequences of its cases. Cases are ordered by their first
+    occurrence and events keep their order within each case, as in pm4py's conversion to an EventLog
+    :param log: the data frame containing the events
+    :param case_id_key: the column identifying the case of an event
+    :param activity_key: the column containing the activity label of an event
+    :return: a list containing an array of activity labels for each case
+    """
+    order, boundaries = _group_cases(log, case_id_key)
+    if len(order) == 0:
+        return []
+    activities = log[activity_key].to_numpy(dtype=object)[order]
+    return np.split(activities, boundaries)
+
+
+def _group_cases(log: pd.DataFrame, case_id_key: str) -> tuple:
+    """
+    returns the order in which the events of a data frame-based event log are grouped by case, with cases ordered by
+    their first occurrence and events keeping their order within each case, and the positions at which cases start
+    in this order, except for the first case
+    """
+    case_codes, _ = pd.factorize(log[case_id_key])
+    order = np.argsort(case_codes, kind="stable")
+    boundaries = np.cumsum(np.bincount(case_codes))[:-1]
+    return order, boundaries
+
+
+@activity_based
 def retrieve_species_n_gram(trace, n):
     if len(trace) < n:
         return ["NULL"]
-    events = [x['concept:name'] for x in trace]
+    events = get_activities(trace)
 
     if n >= 2:
         events.insert(0, "START")
@@ -14,34 +101,411 @@ def retrieve_species_n_gram(trace, n):
     return [",".join(events[x:x + n]) for x in range(0, len(events) - n+1)]
 
 
+class ActivityCodebook:
+    """
+    Assigns integer codes to activities on first sight, from which n-grams are packed into single integer keys by
+    shifting in the code of one activity per event. As the codes depend on the order in which activities are first
+    seen, n-grams packed by different codebooks are translated into the codes of one of them when estimators are
+    merged
+    """
+
+    def __init__(self) -> None:
+        # codes of the activities seen so far, and the activity belonging to each code
+        self.codes = {}
+        self.labels = [None, "START", "END"]
+
+    def encode(self, trace) -> list:
+        """
+        returns the codes of the activities of a non-empty trace, assigning codes to activities not seen before
+        :param trace: the trace, or its sequence of activity labels
+        :return: the activity codes
+        """
+        activities = trace if isinstance(trace[0], str) else get_activities(trace)
+        codes = self.codes
+        try:
+            return [codes[a] for a in activities]
+        except KeyError:
+            return [codes.get(a) or self.__add_activity(a) for a in activities]
+
+    def __add_activity(self, activity: str) -> int:
+        code = len(self.labels)
+        if code >> CODE_BITS:
+            raise RuntimeError('Cannot pack n-grams of more than ' + str((1 << CODE_BITS) - END_CODE - 1) +
+                               ' distinct activities')
+        self.codes[activity] = code
+        self.labels.append(activity)
+        return code
+
+    def decode(self, key: int) -> str:
+        """
+        returns the readable label of an n-gram
+        :param key: the packed n-gram, as retrieved from a trace
+        :return: the activities of the n-gram, separated by commas as in retrieve_species_n_gram
+        """
+        if key == 0:
+            return "NULL"
+        # as all codes are positive, the length of an n-gram follows from the number of bits of its key
+        code_mask = (1 << CODE_BITS) - 1
+        n = -(-key.bit_length() // CODE_BITS)
+        return ",".join(self.labels[(key >> (CODE_BITS * i)) & code_mask] for i in reversed(range(n)))
+
+    def translate(self, keys: list, other: "ActivityCodebook") -> list:
+        """
+        translates packed n-grams retrieved by another instance, e.g. one profiling a different shard of a log, into
+        the packed n-grams of this instance, assigning codes to activities not seen before
+        :param keys: the packed n-grams, as retrieved by the other instance
+        :param other: the instance that retrieved the n-grams
+        :return: the packed n-grams of the same activities, in the same order
+        """
+        codes = [0, START_CODE, END_CODE] + [self.codes.get(a) or self.__add_activity(a)
+                                             for a in other.labels[END_CODE + 1:]]
+        if all(c == i for i, c in enumerate(codes)):
+            return keys
+        code_mask = (1 << CODE_BITS) - 1
+        translated = []
+        for key in keys:
+            packed = 0
+            shift = 0
+            while key:
+                packed = packed | codes[key & code_mask] << shift
+                key = key >> CODE_BITS
+                shift = shift + CODE_BITS
+            translated.append(packed)
+        return translated
+
+
+class PackedNGram(ActivityCodebook):
+    """
+    Retrieves the same n-grams as retrieve_species_n_gram, but as integers rather than strings. Each n-gram is packed
+    into a single integer key of the activity codes of its window, so that no strings are built for each window. The
+    key of an n-gram is only decoded into its readable label, e.g. "A,B,C", on demand
+    """
+
+    activity_based = True
+
+    def __init__(self, n: int) -> None:
+        """
+        :param n: the length of the n-grams
+        """
+        super().__init__()
+        self.n = n
+
+    def __call__(self, trace) -> list:
+        n = self.n
+        if len(trace) < n:
+            return [0]
+        encoded = self.encode(trace)
+        if n == 1:
+            return encoded
+        encoded = [START_CODE] + encoded + [END_CODE]
+        # the window is moved by one activity by shifting out the code of its first activity
+        mask = (1 << (CODE_BITS * n)) - 1
+        key = 0
+        for c in encoded[:n - 1]:
+            key = (key << CODE_BITS) | c
+        species = []
+        append = species.append
+        for c in encoded[n - 1:]:
+            key = ((key << CODE_BITS) | c) & mask
+            append(key)
+        return species
+
+
+class NGramOrders(ActivityCodebook):
+    """
+    Retrieves the packed n-grams of all orders 1 to max_n of a trace in a single pass. The key of each n-gram is
+    obtained from the key of its (n-1)-gram prefix by shifting in the code of one more activity, i.e. keys are the
+    nodes of a prefix trie shared by all orders, and each additional order costs a single pass over the trace. As it
+    retrieves several species definitions at once, it is not a species retrieval function itself. Instead, species
+    definitions are registered per order using order(n), and all of them share the n-grams retrieved for the latest
+    trace. Retrieves the same species as PackedNGram for each order
+    """
+
+    # the latest trace and its n-grams, shared by the species definitions of all orders
+    _last_trace = None
+    _last_species = None
+
+    def __init__(self, max_n: int) -> None:
+        """
+        :param max_n: the length of the longest n-grams
+        """
+        super().__init__()
+        self.max_n = max_n
+
+    def retrieve(self, trace) -> list:
+        """
+        returns the n-grams of all orders of a trace
+        :param trace: the trace, or its sequence of activity labels
+        :return: a list holding the n-grams of order n at position n - 1
+        """
+        if trace is self._last_trace:
+            return self._last_species
+        species = [[0]] * self.max_n
+        if len(trace) > 0:
+            # as in retrieve_species_n_gram, 1-grams are not padded with the start and end activities
+            encoded = self.encode(trace)
+            species[0] = encoded
+            padded = [START_CODE] + encoded + [END_CODE]
+            keys = padded
+            for n in range(2, min(len(encoded), self.max_n) + 1):
+                keys = [(key << CODE_BITS) | c for key, c in zip(keys, padded[n - 1:])]
+                species[n - 1] = keys
+        self._last_trace = trace
+        self._last_species = species
+        return species
+
+    def order(self, n: int) -> "NGramOrder":
+        """
+        returns a species retrieval function for the n-grams of a single order, sharing this instance
+        :param n: the length of the n-grams, at most max_n
+        :return: the species retrieval function
+        """
+        if not 1 <= n <= self.max_n:
+            raise RuntimeError('Cannot retrieve n-grams of length ' + str(n) + ', at most ' + str(self.max_n) +
+                               ' are supported')
+        return NGramOrder(self, n)
+
+
+class NGramOrder:
+    """
+    Retrieves the packed n-grams of a single order from a shared NGramOrders instance
+    """
+
+    activity_based = True
+
+    def __init__(self, orders: NGramOrders, n: int) -> None:
+        self.orders = orders
+        self.n = n
+
+    def __call__(self, trace) -> list:
+        return self.orders.retrieve(trace)[self.n - 1]
+
+    def decode(self, key: int) -> str:
+        """
+        returns the readable label of an n-gram
+        :param key: the packed n-gram, as retrieved from a trace
+        :return: the activities of the n-gram, separated by commas as in retrieve_species_n_gram
+        """
+        return self.orders.decode(key)
+
+    def translate(self, keys: list, other: "NGramOrder") -> list:
+        """
+        translates packed n-grams retrieved by another instance into the packed n-grams of this instance, see
+        ActivityCodebook.translate
+        """
+        return self.orders.translate(keys, other.orders)
+
+
+@activity_based
 def retrieve_species_trace_variant(trace):
-    return [",".join([x["concept:name"] for x in trace])]
+    return [",".join(get_activities(trace))]
+
+
+class TimedActivitySpecies(ABC):
+    """
+    Retrieves activities labelled with the time passed since the previous event of their case, as integer codes of
+    the labels of retrieve_timed_activity and retrieve_timed_activity_exponential. For data frame-based event logs,
+    the species of all cases are retrieved at once: timestamp differences are taken per case in one vectorised step
+    and bucketed, and only the distinct combinations of activity and bucket are labelled. Labels are assigned codes
+    on first sight and are only decoded again on demand
+    """
+
+    batch_based = True
+    # flag indicating if activities are taken in the order of their timestamps, while times are taken between
+    # consecutive events in the order of the trace
+    sorted_activities = False
+
+    def __init__(self) -> None:
+        # codes of the labels seen so far, and the label belonging to each code
+        self.codes = {}
+        self.labels = []
+
+    def __call__(self, trace) -> list:
+        return [self.encode(label) for label in self.retrieve_labels(trace)]
+
+    @abstractmethod
+    def retrieve_labels(self, trace) -> list:
+        """
+        returns the labels of the timed activities of a single trace
+        :param trace: the trace
+        :return: the labels of the timed activities
+        """
+
+    @abstractmethod
+    def buckets(self, hours: np.ndarray, first: np.ndarray, single: np.ndarray) -> np.ndarray:
+        """
+        assigns each event to an integer bucket of the time passed since the previous event of its case
+        :param hours: the hours passed since the previous event of the case, undefined for first events
+        :param first: flags indicating the first event of each case
+        :param single: flags indicating events of cases consisting of a single event
+        :return: the bucket of each event
+        """
+
+    @abstractmethod
+    def suffix(self, bucket: int) -> str:
+        """
+        returns the part of a label following the activity for a bucket
+        :param bucket: the bucket
+        :return: the suffix, as in the labels of the corresponding trace-based function
+        """
+
+    def encode(self, label: str) -> int:
+        """
+        returns the code of a label, assigning the next free code if the label has not been seen before
+        :param label: the label
+        :return: the code of the label
+        """
+        code = self.codes.setdefault(label, len(self.labels))
+        if code == len(self.labels):
+            self.labels.append(label)
+        return code
+
+    def decode(self, code: int) -> str:
+        """
+        returns the label belonging to a code
+        :param code: the code, as retrieved from a trace
+        :return: the label
+        """
+        return self.labels[code]
+
+    def translate(self, codes: list, other: "TimedActivitySpecies") -> list:
+        """
+        translates codes assigned by another instance, e.g. one profiling a different shard of a log, into the codes
+        of this instance, assigning codes to labels not seen before
+        :param codes: the codes, as retrieved by the other instance
+        :param other: the instance that retrieved the codes
+        :return: the codes of the same labels, in the same order
+        """
+        mapping = [self.encode(label) for label in other.labels]
+        if all(c == i for i, c in enumerate(mapping)):
+            return codes
+        return [mapping[c] for c in codes]
+
+    def retrieve_batch(self, log: pd.DataFrame, case_id_key: str = "case:concept:name",
+                       activity_key: str = "concept:name", timestamp_key: str = "time:timestamp") -> list:
+        """
+        retrieves the species of all cases of a data frame-based event log at once
+        :param log: the data frame containing the events
+        :param case_id_key: the column identifying the case of an event
+        :param activity_key: the column containing the activity label of an event
+        :param timestamp_key: the column containing the timestamp of an event
+        :return: a list containing the species of each case, ordered as in get_activity_sequences
+        """
+        if "lifecycle:transition" in log.columns:
+            # start and complete events are paired per trace, see pair_lifecycle_events
+            return [self(trace) for trace in pm4py.convert_to_event_log(log)]
+        order, boundaries = _group_cases(log, case_id_key)
+        if len(order) == 0:
+            return []
+        first = np.zeros(len(order), dtype=bool)
+        first[0] = True
+        first[boundaries] = True
+        sizes = np.diff(np.concatenate(([0], boundaries, [len(order)])))
+        single = np.repeat(sizes == 1, sizes)
+        hours = log[timestamp_key].iloc[order].diff().dt.total_seconds().to_numpy() / 60 / 60
+        buckets = self.buckets(hours, first, single)
+
+        activity_order = order
+        if self.sorted_activities:
+            timestamps = log[timestamp_key].iloc[order].to_numpy(dtype="datetime64[ns]")
+            activity_order = order[np.lexsort((timestamps, np.repeat(np.arange(len(sizes)), sizes)))]
+
+        # only the distinct combinations of activity and bucket are labelled
+        activity_codes, activities = pd.factorize(log[activity_key].to_numpy(dtype=object)[activity_order])
+        pairs, inverse = np.unique(np.stack([activity_codes, buckets]), axis=1, return_inverse=True)
+        codes = np.array([self.encode(str(activities[a]) + "_" + self.suffix(b))
+                          for a, b in zip(pairs[0].tolist(), pairs[1].tolist())], dtype=np.int64)
+        return [case.tolist() for case in np.split(codes[inverse.reshape(-1)], boundaries)]
+
+
+class TimedActivity(TimedActivitySpecies):
+    """
+    Retrieves activities labelled with the time passed since the previous event, rounded up to a multiple of
+    interval_size hours, as retrieve_timed_activity
+    """
+
+    # bucket of the first event of each case, which is labelled 0 regardless of the interval size
+    FIRST = np.iinfo(np.int64).min
+
+    def __init__(self, interval_size) -> None:
+        """
+        :param interval_size: the size of the time intervals, in hours
+        """
+        super().__init__()
+        self.interval_size = interval_size
+
+    def retrieve_labels(self, trace) -> list:
+        return retrieve_timed_activity(trace, self.interval_size)
+
+    def buckets(self, hours: np.ndarray, first: np.ndarray, single: np.ndarray) -> np.ndarray:
+        buckets = np.ceil(np.where(first, 0, hours) / self.interval_size).astype(np.int64)
+        buckets[first] = self.FIRST
+        return buckets
+
+    def suffix(self, bucket: int) -> str:
+        if bucket == self.FIRST:
+            return "0"
+        return str(self.interval_size * bucket)
+
+
+class ExponentialTimedActivity(TimedActivitySpecies):
+    """
+    Retrieves activities labelled with the time passed since the previous event, in exponentially growing intervals
+    of hours, as retrieve_timed_activity_exponential
+    """
+
+    sorted_activities = True
+
+    def retrieve_labels(self, trace) -> list:
+        return retrieve_timed_activity_exponential(trace)
+
+    def buckets(self, hours: np.ndarray, first: np.ndarray, single: np.ndarray) -> np.ndarray:
+        # labels are twice the bucket, i.e. 0 for first events, 2 for less than two hours and single events
+        buckets = np.ceil(np.log(np.where(hours >= 1, hours, 1)) / np.log(2)).astype(np.int64)
+        buckets[hours < 1] = 1
+        buckets[first] = 0
+        buckets[single] = 1
+        return buckets
+
+    def suffix(self, bucket: int) -> str:
+        return str(2 * bucket)
+
+
+def pair_lifecycle_events(trace) -> list:
+    """
+    pairs the start and complete events of a trace with lifecycle transitions. Each complete event is paired with the
+    earliest unpaired start event of the same activity, kept in a FIFO queue per activity, so that a trace is paired
+    in linear time. Complete events without an unpaired start event are paired with the preceding event of the trace
+    :param trace: the trace, whose events carry a lifecycle transition
+    :return: for each complete event, its activity and the time passed since the paired event, or None if an
+    unpaired complete event is the first event of the trace
+    """
+    open_starts = {}
+    pairs = []
+    for ide, e in enumerate(trace):
+        transition = e["lifecycle:transition"].lower()
+        if "start" in transition:
+            open_starts.setdefault(e["concept:name"], deque()).append(e["time:timestamp"])
+        elif "complete" in transition:
+            starts = open_starts.get(e["concept:name"])
+            if starts:
+                pairs.append((e["concept:name"], e["time:timestamp"] - starts.popleft()))
+            elif ide == 0:
+                pairs.append((e["concept:name"], None))
+            else:
+                pairs.append((e["concept:name"], e["time:timestamp"] - trace[ide - 1]["time:timestamp"]))
+    return pairs
 
 
 def retrieve_timed_activity(trace, interval_size):
     l=[]
     if "lifecycle:transition" in trace[0]:
-        open_set = []
-        for ide,e in enumerate(trace):
-            if "start" in e["lifecycle:transition"].lower():
-                open_set.append(e)
-            elif "complete" in e["lifecycle:transition"].lower():
-                found = False
-                for idx, x in enumerate(open_set):
-                    if x["concept:name"] == e["concept:name"]:
-                        time = trace[ide]["time:timestamp"] - trace[idx]["time:timestamp"]
-                        t = interval_size * math.ceil((time.total_seconds() / 60 / 60) / interval_size)
-                        l.append(e["concept:name"] + "_" + str(t))
-                        open_set.pop(idx)
-                        found = True
-                        break
-                if not found:
-                    if ide == 0:
-                        l.append(e["concept:name"]+"_"+str(interval_size))
-                    else:
-                        time = trace[ide]["time:timestamp"] - trace[ide-1]["time:timestamp"]
-                        t = interval_size * math.ceil((time.total_seconds() / 60 / 60) / interval_size)
-                        l.append(e["concept:name"] + "_" + str(t))
+        for activity, time in pair_lifecycle_events(trace):
+            if time is None:
+                l.append(activity + "_" + str(interval_size))
+            else:
+                t = interval_size * math.ceil((time.total_seconds() / 60 / 60) / interval_size)
+                l.append(activity + "_" + str(t))
     else:
         if len(trace) == 1:
             return [trace[0]["concept:name"] + "_0"]
@@ -61,33 +525,12 @@ def retrieve_timed_activity_exponential(trace):
     if len(trace) == 1:
         return [trace[0]["concept:name"] + "_2"]
     if "lifecycle:transition" in trace[0]:
-        open_set = []
-        for ide,e in enumerate(trace):
-            if "start" in e["lifecycle:transition"].lower():
-                open_set.append(e)
-            elif "complete" in e["lifecycle:transition"].lower():
-                found = False
-                for idx, x in enumerate(open_set):
-                    if x["concept:name"] == e["concept:name"]:
-                        time = trace[ide]["time:timestamp"] - trace[idx]["time:timestamp"]
-                        t = time.total_seconds() / 60 / 60
-                        if t < 1:
-                            l.append(e["concept:name"] + "_2")
-                        else:
-                            l.append(e["concept:name"] + "_" + str(2 * math.ceil(math.log(t, 2))))
-                        open_set.pop(idx)
-                        found = True
-                        break
-                if not found:
-                    if ide == 0:
-                        l.append(e["concept:name"]+"_2")
-                    else:
-                        time = trace[ide]["time:timestamp"] - trace[ide-1]["time:timestamp"]
-                        t = time.total_seconds() / 60 / 60
-                        if t < 1:
-                            l.append(e["concept:name"] + "_2")
-                        else:
-                            l.append(e["concept:name"] + "_" + str(2 * math.ceil(math.log(t, 2))))
+        for activity, time in pair_lifecycle_events(trace):
+            t = 0 if time is None else time.total_seconds() / 60 / 60
+            if t < 1:
+                l.append(activity + "_2")
+            else:
+                l.append(activity + "_" + str(2 * math.ceil(math.log(t, 2))))
     else:
         t = sorted(trace, key=lambda d: d['time:timestamp'])
         for idx, e in enumerate(t):
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class SpeciesVocabulary:
+    """
+    Interns species to dense integer ids. Each species is stored once, which allows species counts to be kept in
+    arrays indexed by species id. Species are only decoded again for display, e.g. in rank or species tables
+    """
+
+    def __init__(self) -> None:
+        self.ids = {}
+        self.species = []
+
+    def __len__(self) -> int:
+        return len(self.species)
+
+    def intern(self, species) -> int:
+        """
+        returns the id of a species, assigning the next free id if the species has not been seen before
+        :param species: the species
+        :return: the id of the species
+        """
+        species_id = self.ids.setdefault(species, len(self.species))
+        if species_id == len(self.species):
+            self.species.append(species)
+        return species_id
+
+    def intern_all(self, species: list) -> list:
+        """
+        returns the ids of a sequence of species, assigning new ids to species that have not been seen before
+        :param species: the species
+        :return: the ids of the species, in the same order
+        """
+        ids = self.ids
+        labels = self.species
+        species_ids = []
+        for s in species:
+            species_id = ids.setdefault(s, len(labels))
+            if species_id == len(labels):
+                labels.append(s)
+            species_ids.append(species_id)
+        return species_ids
+
+    def decode(self, species_id: int):
+        """
+        returns the species belonging to an id
+        :param species_id: the id of the species
+        :return: the species
+        """
+        return self.species[species_id]
+
+    def to_dict(self, counts: np.ndarray) -> dict:
+        """
+        decodes an array of species counts indexed by species id into a dictionary of species and their counts,
+        omitting species with a count of zero
+        :param counts: the species counts, indexed by species id
+        :return: the species with corresponding counts
+        """
+        species_ids = np.flatnonzero(counts[:len(self.species)])
+        return {self.species[i]: c for i, c in zip(species_ids.tolist(), counts[species_ids].tolist())}
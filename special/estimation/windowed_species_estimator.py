@@ -0,0 +1,147 @@
+from collections import deque
+from collections.abc import Iterable
+from datetime import timedelta
+
+import pandas as pd
+import pm4py
+from pm4py.objects.log.obj import EventLog, Trace
+
+from special.estimation.species_estimator import SpeciesEstimator
+from special.estimation.species_retrieval import is_activity_based, get_activity_sequences
+
+
+class WindowedSpeciesEstimator(SpeciesEstimator):
+    """
+    Estimates diversity and completeness profiles over a sliding window, either of the most recent traces or of the
+    traces completed within a recent period of time. Traces leaving the window are removed from the reference
+    samples, keeping frequency counts and running sums consistent, so that the profiles of the current window can be
+    updated after every trace at a cost proportional to the number of species of a trace. This allows monitoring
+    live event streams for drift in diversity
+    """
+
+    def __init__(self, window_size: int | None = None, window_duration: timedelta | None = None, d0: bool = True,
+                 d1: bool = False, d2: bool = False, c0: bool = True, c1: bool = True, l_n: list = [.9, .95, .99],
+                 step_size: int | None = 1, lazy: bool = False, timestamp_key: str = "time:timestamp"):
+        """
+        :param window_size: the number of most recent traces kept in the window
+        :param window_duration: the period of time covered by the window, relative to the completion time of the most
+        recent trace. Requires traces carrying timestamps
+        :param d0: flag indicating if D0(=species richness) should be included
+        :param d1: flag indicating if D1(=exponential Shannon entropy) should be included
+        :param d2: flag indicating if D2(=Simpson diversity index) should be included
+        :param c0: flag indicating if C0(=completeness) should be included
+        :param c1: flag indicating if C1(=coverage) should be included
+        :param l_n: list of desired completeness values for estimation additional sampling effort
+        :param step_size: the number of added traces after which the profiles of the window are updated. Use None
+        to only update the profiles after all traces have been added
+        :param lazy: flag indicating if diversity and completeness metrics should only be computed on first access
+        :param timestamp_key: the attribute holding the timestamps of events
+        """
+        if (window_size is None) == (window_duration is None):
+            raise RuntimeError('Exactly one of window_size and window_duration has to be set')
+        super().__init__(d0=d0, d1=d1, d2=d2, c0=c0, c1=c1, l_n=l_n, step_size=step_size, lazy=lazy)
+        self.window_size = window_size
+        self.window_duration = window_duration
+        self.timestamp_key = timestamp_key
+
+        # species retrieved from each trace in the window, together with the completion time of the trace
+        self.windows = {}
+        self.no_traces = 0
+        self.current_time = None
+
+    def register(self, species_id: str, function) -> None:
+        super().register(species_id, function)
+        self.windows[species_id] = deque()
+
+    def apply(self, data: pd.DataFrame | EventLog | Trace | list) -> None:
+        """
+        add all observations of an event log in order, moving the window along. The profiles are updated after every
+        step_size traces, as well as once afterward
+        :param data: the event log containing the trace observations
+        """
+        if isinstance(data, pd.DataFrame):
+            # data frames are profiled as a stream as well, as step_size refers to traces rather than checkpoints
+            data = self._split_frame(data)
+        if isinstance(data, (EventLog, list)):
+            self.apply_stream(data)
+            return
+        super().apply(data)
+
+    def extend(self, data: pd.DataFrame | EventLog | Iterable) -> None:
+        """
+        continues moving the window along traces appended to the previously added ones
+        :param data: the appended traces
+        """
+        if isinstance(data, pd.DataFrame):
+            data = self._split_frame(data)
+        super().extend(data)
+
+    def _split_frame(self, data: pd.DataFrame) -> EventLog | list:
+        """
+        splits a data frame-based event log into traces, which are given as activity sequences if all registered
+        species retrieval functions are activity-based and the window does not depend on timestamps
+        :param data: the data frame containing the events
+        :return: the traces
+        """
+        with self.timer.measure("conversion"):
+            # activity sequences do not carry the timestamps needed to move a time-based window
+            if self.window_duration is None and all(is_activity_based(f) for f in self.species_retrieval.values()):
+                return get_activity_sequences(data)
+            return pm4py.convert_to_event_log(data)
+
+    def merge(self, other: "SpeciesEstimator") -> None:
+        # the observations of the other estimator are not part of the window, hence they would never leave it
+        raise RuntimeError('Cannot merge windowed estimators')
+
+    def add_trace(self, trace: Trace | list, extract_activities: bool = False, retrieved: dict | None = None) -> None:
+        if self.window_duration is not None:
+            self.current_time = trace[-1][self.timestamp_key]
+        self.no_traces = self.no_traces + 1
+        super().add_trace(trace, extract_activities, retrieved)
+
+    def add_retrieved_species(self, species_abundance: list, species_id: str, multiplicity: int = 1) -> None:
+        """
+        adds the species of a single observation to the window and removes all observations that left the window from
+        the reference samples
+        :param species_abundance: the species retrieved from the observation, including repetitions
+        """
+        if multiplicity != 1:
+            raise RuntimeError('Cannot add weighted observations to a window')
+        super().add_retrieved_species(species_abundance, species_id)
+        window = self.windows[species_id]
+        window.append((self.current_time, self.metrics[species_id].trace_retrieved_species_abundance))
+
+        if self.window_size is not None:
+            while len(window) > self.window_size:
+                self.remove_observation(window.popleft()[1], species_id)
+        else:
+            while self.current_time - window[0][0] > self.window_duration:
+                self.remove_observation(window.popleft()[1], species_id)
+
+    def remove_observation(self, species_abundance: list, species_id: str) -> None:
+        """
+        removes the species of a single observation that left the window
+        :param species_abundance: the species retrieved from the observation, including repetitions
+        """
+        self.metrics[species_id].remove_species(species_abundance)
+
+        self.metrics[species_id].abundance_sample_size = self.metrics[species_id].abundance_sample_size - len(
+            species_abundance)
+        self.metrics[species_id].incidence_sample_size = self.metrics[species_id].incidence_sample_size - 1
+
+        self.metrics[species_id].abundance_current_total_species_count = \
+            self.metrics[species_id].abundance_current_total_species_count - len(species_abundance)
+        self.metrics[species_id].incidence_current_total_species_count = \
+            self.metrics[species_id].incidence_current_total_species_count - len(set(species_abundance))
+
+        self.metrics[species_id].current_spatial_aggregation = 0
+        if self.metrics[species_id].abundance_current_total_species_count > 0:
+            self.metrics[species_id].current_spatial_aggregation = 1 - (
+                    self.metrics[species_id].incidence_current_total_species_count / self.metrics[
+                species_id].abundance_current_total_species_count)
+
+    def is_checkpoint(self, species_id: str) -> bool:
+        # the sample size is bounded by the window, hence steps are counted in added traces
+        if self.step_size is None:
+            return False
+        return self.no_traces % self.step_size == 0
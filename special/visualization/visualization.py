@@ -50,10 +50,10 @@ EXPECTED_SAMPLING_EFFORT_LAYOUT = go.Layout(
 
 
 def plot_rank_abundance(estimator: SpeciesEstimator, species_id: str, file_name: str, abundance: bool) -> go.Figure:
-    reference_sample = estimator.metrics[species_id].reference_sample_abundance if abundance \
-        else estimator.metrics[species_id].reference_sample_incidence
-    reference_values_sorted = sorted(list(reference_sample.values()), reverse=True)
-    no_species = len(reference_sample)
+    # only the counts are plotted, hence species do not need to be decoded
+    counts = estimator.metrics[species_id].current_counts("abundance" if abundance else "incidence")
+    reference_values_sorted = np.sort(counts[counts > 0])[::-1]
+    no_species = len(reference_values_sorted)
 
     trace1 = go.Scatter(
         x=list(range(1, no_species + 1)),
@@ -1,5 +1,4 @@
 import os
-from functools import partial
 from typing import Sequence
 
 from htmltools import Tagifiable, Tag, MetadataNode
@@ -23,12 +22,15 @@ DEFAULT_ATTRS = {
 
 DEFAULT_SET_SIZE: int = 100
 
+# n-grams of all lengths are retrieved in a single pass over each trace
+N_GRAMS = species_retrieval.NGramOrders(5)
+
 RETRIVAL_MAP = {
-    "1-gram": partial(species_retrieval.retrieve_species_n_gram, n=1),
-    "2-gram": partial(species_retrieval.retrieve_species_n_gram, n=2),
-    "3-gram": partial(species_retrieval.retrieve_species_n_gram, n=3),
-    "4-gram": partial(species_retrieval.retrieve_species_n_gram, n=4),
-    "5-gram": partial(species_retrieval.retrieve_species_n_gram, n=5),
+    "1-gram": N_GRAMS.order(1),
+    "2-gram": N_GRAMS.order(2),
+    "3-gram": N_GRAMS.order(3),
+    "4-gram": N_GRAMS.order(4),
+    "5-gram": N_GRAMS.order(5),
     "trace_variants": species_retrieval.retrieve_species_trace_variant,
     # "2-gram_complete_log": species_retrieval.retrieve_timed_activity,
     # "2-gram_all_metrics": species_retrieval.retrieve_timed_activity_exponential,